@@ -72,23 +72,15 @@ def ocr_and_compute_images_score(
     return_found_elements: bool = False,
     retry_with_google_bounding_polys: bool = False,
 ) -> Union[GlobalScore, Tuple[GlobalScore, List[LabelMaterial], List[LabelCountry]]]:
-    if google_images_bounding_polys is None:
-        images_labels_and_google_bounding_polys = [
-            ocr(image_bytes=image_bytes) for image_bytes in images_bytes
-        ]
-    else:
-        images_labels_and_google_bounding_polys = [
-            ocr(image_bytes=image_bytes, image_bounding_polys=google_bounding_polys)
-            for image_bytes, google_bounding_polys in zip(
-                images_bytes, google_images_bounding_polys
-            )
-        ]
+    # all the images are read by Google Vision at once
+    images_labels_and_google_bounding_polys = ocr.batch(
+        images_bytes=images_bytes, images_bounding_polys=google_images_bounding_polys
+    )
     label = ""
     if pre_known_labels is not None:
         label += " ".join(pre_known_labels)
     label = f"{label} {' '.join(label for label, _ in images_labels_and_google_bounding_polys)}"
-    found_materials = interpreter.find_materials(label=label)
-    found_country = interpreter.find_country(label=label)
+    found_materials, found_country = interpreter.interpret(label=label)
     try:
         raise_compute_score_exceptions_from_interpreter(
             label=label, found_materials=found_materials, found_country=found_country
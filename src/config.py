@@ -9,15 +9,34 @@ class Config:
         # jpeg is lighter than other image format so it is more
         # convenient to sent to Google Vision for speed
         google_image_format = "JPEG"
+        # all the images of a request are sent to Google Vision in a single request
+        batch_vision_requests = True
+        # images of a request read and preprocessed at the same time
+        max_concurrent_images = 4
+        # total size of the preprocessed images kept across requests, None for no cache
+        preprocessed_images_cache_bytes = 32 * 1024 * 1024
 
     class WordsMatcher:
         similarity_type = "difflib"
         tokenization_type = "split"
         extract_with_multi_process = False
         similarity_threshold = 0.875
+        prune_similarity = True
+        # one of None, "trigram", "bk_tree"
+        candidate_index = "trigram"
+        exact_match_fast_path = True
+        multi_tokens_trie = True
+        # number of similarity scores kept across requests, None for no cache
+        similarity_cache_size = None
+        # first only look for the spellings written in the scripts of the label
+        script_pruning = False
 
     class Interpreter:
         filter_overlapping_materials_on = "longest"
+        # only look for materials around percentages and for countries after words
+        # such as "made in", in long labels made mostly of care instructions
+        anchor_guided_search = False
+        anchor_window_tokens = 10
 
     class Inputs:
         DATABASE_API_URL = os.environ.get("DATABASE_API_URL")
@@ -1,7 +1,9 @@
+import bisect
+import hashlib
 import json
-import os
 import re
-from typing import List, Optional
+import threading
+from typing import List, NamedTuple, Optional, Sequence, Tuple
 
 import cachetools.func
 from database.api.meta.country import get_all_countries
@@ -11,21 +13,14 @@ from database.api.schemas.material import Material
 from fastapi import Depends
 
 from src.config import Config
-from src.words_matcher.match import MatchFilter
+from src.normalizer import NormalizedLabel, normalize_label
+from src.words_matcher.match import MatchBatch, MatchFilter
+from src.words_matcher.referential import CompiledReferential
 from src.words_matcher.words_matcher import WordsMatcher, get_words_matcher
 
-ADD_SPACE_ELEMENTS = [
-    "madein",
-    "made in",
-    "/",
-    "%",
-    "-",
-]
-
-CANCEL_ELEMENTS = [
-    "(",
-    ")",
-]
+# the digits of a percentage follow a whitespace or start the label, if not they
+# would be the last digits of something else, e.g a reference number
+PERCENTAGE_PATTERN = re.compile(r"(?<![^ ])(\d+) ?%")
 
 
 class LabelMaterial(Material):
@@ -42,6 +37,56 @@ class LabelCountry(Country):
     pass
 
 
+class LabelPercentages(NamedTuple):
+    # the percentages of a label in order of appearance, with the position of their
+    # first character and of the character following them, both sorted since
+    # percentages do not overlap
+    values: List[float]
+    starts: List[int]
+    ends: List[int]
+
+
+def _merge_windows(windows: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Merges the (start, end) windows, end excluded, that overlap or are only one
+    character apart, so that no token is cut"""
+    merged = []
+    for start, end in sorted(windows):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _token_windows(
+    text: str, positions: Sequence[int], tokens_before: int, tokens_after: int
+) -> List[Tuple[int, int]]:
+    """Returns the (start, end) windows, end excluded, of the tokens of text around
+    each position, merged when they overlap"""
+    tokens_starts = [0] + [match.end() for match in re.finditer(" ", text)]
+    windows = []
+    for position in positions:
+        token_idx = max(0, bisect.bisect_right(tokens_starts, position) - 1)
+        first_token_idx = max(0, token_idx - tokens_before)
+        next_token_idx = token_idx + tokens_after + 1
+        end = len(text)
+        if next_token_idx < len(tokens_starts):
+            # the whitespace before the next token is left out
+            end = tokens_starts[next_token_idx] - 1
+        windows.append((tokens_starts[first_token_idx], end))
+    return _merge_windows(windows)
+
+
+class ReferentialTag:
+    material = "material"
+    country = "country"
+
+
+class LabelInterpretation(NamedTuple):
+    materials: List[LabelMaterial]
+    country: Optional[LabelCountry]
+
+
 class Interpreter:
     def __init__(
         self,
@@ -49,8 +94,17 @@ class Interpreter:
         countries: List[Country],
         similarity_threshold: float = 0.85,
         words_matcher: WordsMatcher = None,
-        filter_overlapping_materials_on: str = MatchFilter.longest
+        filter_overlapping_materials_on: str = MatchFilter.longest,
+        anchor_guided_search: bool = False,
+        anchor_window_tokens: int = 10,
     ):
+        """
+        :param anchor_guided_search: This indicates whether to only look for materials
+            around percentages and for countries after words such as 'made in', the
+            whole label being searched for the kind of words without such anchors
+        :param anchor_window_tokens: The number of tokens on each side of a percentage
+            and after words such as 'made in' that are searched
+        """
         self.words_matcher = (
             words_matcher
             if words_matcher is not None
@@ -59,27 +113,18 @@ class Interpreter:
         self.materials = materials
         self.countries = countries
         self.filter_overlapping_materials_on = filter_overlapping_materials_on
+        self.anchor_guided_search = anchor_guided_search
+        self.anchor_window_tokens = anchor_window_tokens
 
         self.spelling_to_material: dict = None
         self.spelling_to_country: dict = None
         self.material_names: List[str] = None
         self.country_names: List[str] = None
+        # the material and country names, tagged as such, looked for in a single pass
+        self.referential: CompiledReferential = None
 
         self._build()
 
-    def _standardize_label(self, label: str):
-        # add a space in case label starts with percentage to be compliant
-        # with regex that assumes a space before percentage digits
-        label = f" {label}"
-        label = label.replace(os.linesep, " ").lower()
-        for element in CANCEL_ELEMENTS:
-            label = label.replace(element, "")
-        for element in ADD_SPACE_ELEMENTS:
-            label = label.replace(element, f" {element} ")
-        # replace all trailing whitespaces by a single whitespace
-        label = re.sub("[ ]{2,}", " ", label)
-        return label
-
     @staticmethod
     def _standardize_material_name(material_name: str):
         return material_name.lower()
@@ -101,59 +146,164 @@ class Interpreter:
         }
         self.material_names = list(self.spelling_to_material.keys())
         self.country_names = list(self.spelling_to_country.keys())
+        self.referential = self.words_matcher.compile_referential(
+            self.material_names + self.country_names,
+            tags=[ReferentialTag.material] * len(self.material_names)
+            + [ReferentialTag.country] * len(self.country_names),
+        )
+        # the material and country names looked for separately, each in its own
+        # parts of the label, and the position of their first entry in referential
+        self.tags_referentials: List[Tuple[str, CompiledReferential, int]] = []
+        if self.anchor_guided_search:
+            self.tags_referentials = [
+                (
+                    ReferentialTag.material,
+                    self.words_matcher.compile_referential(
+                        self.material_names,
+                        tags=[ReferentialTag.material] * len(self.material_names),
+                    ),
+                    0,
+                ),
+                (
+                    ReferentialTag.country,
+                    self.words_matcher.compile_referential(
+                        self.country_names,
+                        tags=[ReferentialTag.country] * len(self.country_names),
+                    ),
+                    len(self.material_names),
+                ),
+            ]
+
+    @staticmethod
+    def _find_percentages(label: str) -> "LabelPercentages":
+        """Finds all the percentages of label in a single pass"""
+        percentages = LabelPercentages(values=[], starts=[], ends=[])
+        for match in PERCENTAGE_PATTERN.finditer(label):
+            percentages.values.append(float(match.group(1)))
+            percentages.starts.append(match.start())
+            percentages.ends.append(match.end())
+        return percentages
 
     @staticmethod
     def _find_material_percentage(
-        label: str, label_material: str, look_left_first: Optional[bool] = None
+        percentages: "LabelPercentages",
+        material_start: int,
+        material_end: int,
+        look_left_first: Optional[bool] = None,
     ):
+        """Finds the percentage closest to a material on the side looked at first, and
+        on the other side if there is none
+
+        :param percentages: The percentages of the label the material is found in
+        :param material_start: The position of the first character of the material
+        :param material_end: The position of the last character of the material
+        :param look_left_first: Whether to look on the left of the material first
+        """
         if look_left_first is None:
             look_left_first = True
-        # a whitespace next to the first digit is enforced, if not the '.*' part would
-        # also match the first digits of the percentage
-        expressions = [
-            "{}.* (\d+) ?%.*{}"  # if material and its translations are next to percentage
-        ]
-        if look_left_first:
-            args = ["", label_material]
-            found_on_left = True
-        else:
-            args = [label_material, ""]
-            found_on_left = False
+        left_idx = bisect.bisect_right(percentages.ends, material_start) - 1
+        right_idx = bisect.bisect_right(percentages.starts, material_end)
+        left, right = None, None
+        if left_idx >= 0:
+            left = percentages.values[left_idx]
+        if right_idx < len(percentages.values):
+            right = percentages.values[right_idx]
+        sides = [(left, True), (right, False)]
+        if not look_left_first:
+            sides = sides[::-1]
+        for percentage, found_on_left in sides:
+            if percentage is not None:
+                return percentage, found_on_left
+        return None, None
 
-        # try look on one side
-        for expression in expressions:
-            if matches := re.findall(expression.format(*args), label):
-                return float(matches[0]), found_on_left
+    def _find_matches(
+        self, label: NormalizedLabel, percentages: "LabelPercentages"
+    ) -> MatchBatch:
+        """Finds the material and country names of label in a single pass, the
+        matches being filtered afterwards for materials and countries separately
+
+        With the anchor guided search, the material and country names are looked for
+        separately, each in the windows around its anchors only when the label has
+        some, the matches being merged into a single batch.
+        """
+        windows_per_tag = {}
+        if self.anchor_guided_search and percentages.starts:
+            windows_per_tag[ReferentialTag.material] = _token_windows(
+                label.text,
+                percentages.starts,
+                tokens_before=self.anchor_window_tokens,
+                tokens_after=self.anchor_window_tokens,
+            )
+        if self.anchor_guided_search and label.origin_anchors_ends:
+            windows_per_tag[ReferentialTag.country] = _token_windows(
+                label.text,
+                label.origin_anchors_ends,
+                tokens_before=0,
+                tokens_after=self.anchor_window_tokens,
+            )
+        if not windows_per_tag:
+            return self.words_matcher.find_match_batches(
+                sentences=[label],
+                referential=self.referential,
+                keep_best_same_match=False,
+                filter_same_location_match=False,
+            )[0]
+
+        # each kind of words is only looked for within the windows around its
+        # anchors, or in the whole label when it has none
+        match_batches, offsets = [], []
+        for tag, referential, entries_offset in self.tags_referentials:
+            regions = windows_per_tag.get(tag, [(0, len(label.text))])
+            match_batches += [
+                match_batch.with_referential(self.referential, entries_offset)
+                for match_batch in self.words_matcher.find_match_batches(
+                    sentences=[label.text[start:end] for start, end in regions],
+                    referential=referential,
+                    keep_best_same_match=False,
+                    filter_same_location_match=False,
+                )
+            ]
+            offsets += [start for start, _ in regions]
+        return MatchBatch.concatenate(label.text, match_batches, offsets)
+
+    def interpret(self, label: str) -> LabelInterpretation:
+        """Finds both the materials and the country of label, looking for them in a
+        single pass over it"""
+        label = normalize_label(label)
+        percentages = self._find_percentages(label.text)
+        matches = self._find_matches(label, percentages)
+        return LabelInterpretation(
+            materials=self._find_materials(matches, percentages),
+            country=self._find_country(label, matches),
+        )
 
-        # try look on the other side
-        args = args[::-1]
-        found_on_left = not found_on_left
-        for expression in expressions:
-            if matches := re.findall(expression.format(*args), label):
-                return matches[0], found_on_left
+    def find_materials(self, label: str):
+        label = normalize_label(label)
+        percentages = self._find_percentages(label.text)
+        return self._find_materials(self._find_matches(label, percentages), percentages)
 
-        return None, None
+    def find_country(self, label: str):
+        label = normalize_label(label)
+        percentages = self._find_percentages(label.text)
+        return self._find_country(label, self._find_matches(label, percentages))
 
-    def find_materials(self, label: str):
+    def _find_materials(self, matches: MatchBatch, percentages: "LabelPercentages"):
         label_materials = dict()
-        label = self._standardize_label(label)
-        matches = self.words_matcher.find_words_in_sentences(
-            sentences=[label],
-            referential=self.material_names,
-            keep_best_same_match=True,
-            filter_same_location_match=True,
-            filter_same_location_match_on=self.filter_overlapping_materials_on,
-        )[0]
+        matches = (
+            matches.with_tag(ReferentialTag.material)
+            .best_per_word()
+            .without_overlaps(filter_on=self.filter_overlapping_materials_on)
+            .to_matches()
+        )
 
         # sort matches from first found in text to last found in text
         matches = sorted(matches, key=lambda match: match.start)
         look_left_first = None
         for match in matches:
-            # standardize one more time in case words_matcher standardization
-            # has introduced something wrong
             percentage, found_on_left = self._find_material_percentage(
-                label=self._standardize_label(match.sentence),
-                label_material=match.matching_sub_sentence,
+                percentages=percentages,
+                material_start=match.start,
+                material_end=match.end,
                 look_left_first=look_left_first,
             )
             if found_on_left is not None and look_left_first is None:
@@ -171,33 +321,26 @@ class Interpreter:
         ]
         return label_materials
 
-    def find_country(self, label: str):
-        label = self._standardize_label(label)
-        matches = self.words_matcher.find_words_in_sentences(
-            sentences=[label],
-            referential=self.country_names,
-            keep_best_same_match=True,
-            filter_same_location_match=False,
-        )[0]
-        country = None
-        # select in priority the country which corresponds to a regex
-        # of which we are sure
-        for match in matches:
-            # check if the part of the sentence corresponding to a country
-            # is next to the words 'made in'
-            if re.findall(f"made in ?{match.matching_sub_sentence}", label):
-                country = LabelCountry(
-                    **self.spelling_to_country[match.found_word].dict()
-                )
-        if matches and country is None:
-            # select country that is found first in text
-            matches = sorted(
-                matches, key=lambda match: match.sentence.find(match.matching_sub_sentence)
-            )
-            country = LabelCountry(
-                **self.spelling_to_country[matches[0].found_word].dict()
-            )
-        return country
+    def _find_country(self, label: NormalizedLabel, matches: MatchBatch):
+        matches = matches.with_tag(ReferentialTag.country)
+        # select in priority a country right after words such as 'made in', of which
+        # we are sure, among all the occurrences of the countries since the one after
+        # 'made in' may not be the first of its country, and else the country found
+        # first in text
+        origin_anchors_ends = set(label.origin_anchors_ends)
+        anchored_matches = [
+            match
+            for match in matches.to_matches()
+            if match.start in origin_anchors_ends
+        ]
+        if anchored_matches:
+            match = min(anchored_matches, key=lambda match: (match.start, -match.score))
+        else:
+            matches = matches.best_per_word().to_matches()
+            if not matches:
+                return None
+            match = min(matches, key=lambda match: match.start)
+        return LabelCountry(**self.spelling_to_country[match.found_word].dict())
 
 
 @cachetools.func.ttl_cache(maxsize=None, ttl=float(Config.Inputs.SECONDS_TO_LIVE_DB_REQUEST_CACHE))
@@ -214,10 +357,123 @@ def _get_all_countries(api_url: str, serialize_as_python_obj: bool):
     return get_all_countries(api_url=api_url, serialize_as_python_obj=serialize_as_python_obj)
 
 
+def _referential_version(materials: List[Material], countries: List[Country]) -> str:
+    return hashlib.blake2b(
+        json.dumps(
+            [
+                [material.dict() for material in materials],
+                [country.dict() for country in countries],
+            ],
+            sort_keys=True,
+            default=str,
+        ).encode("utf8"),
+        digest_size=16,
+    ).hexdigest()
+
+
+class _CachedInterpreter(NamedTuple):
+    interpreter: "Interpreter"
+    version: str
+    # the objects returned by the ttl cached database calls the interpreter has been
+    # built from, used to skip the computation of the referential version as long
+    # as the ttl has not expired
+    materials: List[Material]
+    countries: List[Country]
+
+
+class InterpreterCache:
+    """Holds the Interpreter shared by all the requests served by a worker
+
+    The interpreter is only rebuilt, and swapped atomically, when the referential
+    returned by the database api has changed, so that all the preparation that
+    depends on the referential is paid once per referential version.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cached: Optional[_CachedInterpreter] = None
+
+    @property
+    def version(self) -> Optional[str]:
+        cached = self._cached
+        return cached.version if cached is not None else None
+
+    @staticmethod
+    def _is_reusable(
+        cached: Optional[_CachedInterpreter],
+        words_matcher: WordsMatcher,
+        **interpreter_kwargs,
+    ) -> bool:
+        return (
+            cached is not None
+            and cached.interpreter.words_matcher is words_matcher
+            and all(
+                getattr(cached.interpreter, name) == value
+                for name, value in interpreter_kwargs.items()
+            )
+        )
+
+    def get(
+        self,
+        materials: List[Material],
+        countries: List[Country],
+        words_matcher: WordsMatcher,
+        filter_overlapping_materials_on: str = MatchFilter.longest,
+        anchor_guided_search: bool = False,
+        anchor_window_tokens: int = 10,
+    ) -> Interpreter:
+        interpreter_kwargs = dict(
+            filter_overlapping_materials_on=filter_overlapping_materials_on,
+            anchor_guided_search=anchor_guided_search,
+            anchor_window_tokens=anchor_window_tokens,
+        )
+        cached = self._cached
+        if (
+            self._is_reusable(cached, words_matcher, **interpreter_kwargs)
+            and materials is cached.materials
+            and countries is cached.countries
+        ):
+            return cached.interpreter
+        with self._lock:
+            version = _referential_version(materials=materials, countries=countries)
+            # another thread may have refreshed the interpreter while waiting
+            cached = self._cached
+            if (
+                self._is_reusable(cached, words_matcher, **interpreter_kwargs)
+                and version == cached.version
+            ):
+                interpreter = cached.interpreter
+            else:
+                # the scores cached for the previous referential are not looked up
+                # anymore, they would only take room
+                if words_matcher.similarity_cache is not None:
+                    words_matcher.similarity_cache.clear()
+                interpreter = Interpreter(
+                    materials=materials,
+                    countries=countries,
+                    words_matcher=words_matcher,
+                    **interpreter_kwargs,
+                )
+            self._cached = _CachedInterpreter(
+                interpreter=interpreter,
+                version=version,
+                materials=materials,
+                countries=countries,
+            )
+            return interpreter
+
+    def clear(self):
+        with self._lock:
+            self._cached = None
+
+
+interpreter_cache = InterpreterCache()
+
+
 def get_interpreter(
     words_matcher: WordsMatcher = Depends(get_words_matcher),
 ) -> Interpreter:
-    interpreter = Interpreter(
+    return interpreter_cache.get(
         materials=_get_all_materials(
             api_url=Config.Inputs.DATABASE_API_URL, serialize_as_python_obj=True
         ),
@@ -225,6 +481,7 @@ def get_interpreter(
             api_url=Config.Inputs.DATABASE_API_URL, serialize_as_python_obj=True
         ),
         words_matcher=words_matcher,
-        filter_overlapping_materials_on=Config.Interpreter.filter_overlapping_materials_on
+        filter_overlapping_materials_on=Config.Interpreter.filter_overlapping_materials_on,
+        anchor_guided_search=Config.Interpreter.anchor_guided_search,
+        anchor_window_tokens=Config.Interpreter.anchor_window_tokens,
     )
-    return interpreter
@@ -0,0 +1,114 @@
+import re
+from functools import lru_cache
+from typing import NamedTuple, Tuple
+
+ADD_SPACE_ELEMENTS = [
+    "madein",
+    "made in",
+    "/",
+    "%",
+    "-",
+]
+
+CANCEL_ELEMENTS = [
+    "(",
+    ")",
+]
+
+# the words announcing the country a garment is made in, as found once normalized,
+# e.g "fabriqué en" becoming "fabrique en"
+ORIGIN_ANCHORS = [
+    "made in",
+    "madein",
+    "fabrique en",
+    "fabricado en",
+    "hecho en",
+]
+
+# accents that are folded, labels being often written without them
+ACCENTS_FOLDING = {
+    "é": "e",
+    "è": "e",
+}
+
+# a single pass over a lowercased label replaces new lines by whitespaces, removes
+# the cancel elements and folds the accents
+TRANSLATION_TABLE = str.maketrans(
+    {"\n": " ", **{element: None for element in CANCEL_ELEMENTS}, **ACCENTS_FOLDING}
+)
+ACCENTS_FOLDING_TABLE = str.maketrans(ACCENTS_FOLDING)
+# the elements are looked for at once, none of them can overlap another one so this
+# is the same as replacing them one after the other
+ADD_SPACE_PATTERN = re.compile(
+    "|".join(re.escape(element) for element in ADD_SPACE_ELEMENTS)
+)
+SPACES_PATTERN = re.compile("[ ]{2,}")
+ORIGIN_ANCHOR_PATTERN = re.compile(
+    "(?:{}) ?".format("|".join(re.escape(anchor) for anchor in ORIGIN_ANCHORS))
+)
+
+
+class NormalizedLabel(NamedTuple):
+    # the label lowercased, without new lines nor cancel elements, with accents folded,
+    # the add space elements surrounded by a single whitespace and stripped
+    text: str
+    # for each character of text, the position in the raw label of the character it
+    # comes from, inserted whitespaces coming from the element they surround
+    offsets: Tuple[int, ...]
+    # the position in text following each origin anchor and the whitespace after it,
+    # where the country of origin is expected to start
+    origin_anchors_ends: Tuple[int, ...] = ()
+
+    def __str__(self) -> str:
+        return self.text
+
+    def to_raw_span(self, start: int, end: int) -> Tuple[int, int]:
+        """Maps the characters of text from start to end, end excluded, to the
+        characters of the raw label they come from, end excluded"""
+        return self.offsets[start], self.offsets[end - 1] + 1
+
+
+@lru_cache(maxsize=1024)
+def normalize_label(label: str) -> NormalizedLabel:
+    """Normalizes the raw text of a label once for both the interpreter and the words
+    matcher, the same label being normalized from the cache afterwards"""
+    text = label.lower()
+    if len(text) == len(label):
+        offsets = list(range(len(label)))
+    else:
+        # a few characters have a lowercase form made of several characters
+        offsets = [
+            char_idx for char_idx, char in enumerate(label) for _ in char.lower()
+        ]
+    offsets = [
+        offset for char, offset in zip(text, offsets) if char not in CANCEL_ELEMENTS
+    ]
+    text = text.translate(TRANSLATION_TABLE)
+
+    pieces, pieces_offsets, position = [], [], 0
+    for match in ADD_SPACE_PATTERN.finditer(text):
+        start, end = match.span()
+        pieces += [text[position:start], f" {match.group()} "]
+        pieces_offsets += offsets[position:start]
+        pieces_offsets += [offsets[start], *offsets[start:end], offsets[end - 1]]
+        position = end
+    pieces.append(text[position:])
+    pieces_offsets += offsets[position:]
+    text = "".join(pieces)
+
+    # only the first whitespace of a run of whitespaces is kept
+    kept = [True] * len(text)
+    for match in SPACES_PATTERN.finditer(text):
+        kept[match.start() + 1 : match.end()] = [False] * (len(match.group()) - 1)
+    text = SPACES_PATTERN.sub(" ", text)
+    offsets = [offset for offset, keep in zip(pieces_offsets, kept) if keep]
+
+    stripped = text.strip()
+    start = len(text) - len(text.lstrip())
+    return NormalizedLabel(
+        text=stripped,
+        offsets=tuple(offsets[start : start + len(stripped)]),
+        origin_anchors_ends=tuple(
+            match.end() for match in ORIGIN_ANCHOR_PATTERN.finditer(stripped)
+        ),
+    )
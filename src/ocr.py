@@ -1,11 +1,15 @@
 import collections
+import hashlib
 import io
 import logging
 import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
 from functools import cached_property, lru_cache
-from typing import List, Optional
+from typing import Callable, Iterable, List, NamedTuple, Optional, Tuple
 
+import cachetools
 import magic
 import pyheif
 import requests
@@ -20,6 +24,40 @@ logging.basicConfig()
 logging.getLogger().setLevel(logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+# the channel to Google Vision is pinged while idle so that it is still open when the
+# next request comes
+VISION_CHANNEL_OPTIONS = [
+    ("grpc.keepalive_time_ms", 30 * 1000),
+    ("grpc.keepalive_timeout_ms", 10 * 1000),
+    ("grpc.keepalive_permit_without_calls", 1),
+    ("grpc.http2.max_pings_without_data", 0),
+    ("grpc.max_send_message_length", -1),
+    ("grpc.max_receive_message_length", -1),
+]
+
+# the highest number of images Google Vision annotates in a single request
+MAX_IMAGES_PER_VISION_REQUEST = 16
+
+_vision_client: Optional[vision.ImageAnnotatorClient] = None
+_vision_client_lock = threading.Lock()
+
+
+def _create_vision_client() -> vision.ImageAnnotatorClient:
+    transport_class = vision.ImageAnnotatorClient.get_transport_class("grpc")
+    channel = transport_class.create_channel(options=VISION_CHANNEL_OPTIONS)
+    return vision.ImageAnnotatorClient(transport=transport_class(channel=channel))
+
+
+def get_vision_client() -> vision.ImageAnnotatorClient:
+    """Returns the Google Vision client shared by all the requests of the process,
+    created on first use only, its gRPC channel being safe to use across threads"""
+    global _vision_client
+    if _vision_client is None:
+        with _vision_client_lock:
+            if _vision_client is None:
+                _vision_client = _create_vision_client()
+    return _vision_client
+
 
 class Vertex(BaseModel):
     x: float
@@ -70,16 +108,143 @@ class GoogleImageFormat(str, Enum):
     png = "png"
 
 
+class PreprocessedImage(NamedTuple):
+    # the encoded image sent to Google Vision
+    content: bytes
+    size: Tuple[int, int]
+    # the size of the image it comes from, which the positions found by Google Vision
+    # are given back in
+    original_size: Tuple[int, int]
+
+
+class PreprocessedImagesCacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    evictions: int
+    maxsize: int
+    currsize: int
+
+
+class _LRUCache(cachetools.LRUCache):
+    """A least recently used cache counting the items it evicts"""
+
+    def __init__(self, maxsize: int, getsizeof=None):
+        super().__init__(maxsize=maxsize, getsizeof=getsizeof)
+        self.evictions = 0
+
+    def popitem(self):
+        item = super().popitem()
+        self.evictions += 1
+        return item
+
+
+class PreprocessedImagesCache:
+    """A least recently used cache of preprocessed images, bounded by the total size
+    of their encoded content
+
+    Images are keyed by a hash of their bytes, and by the bounding polys they are
+    cropped with, so that the uploads themselves are not held on to.
+    """
+
+    def __init__(self, max_bytes: int):
+        """
+        :param max_bytes: The total size of the encoded preprocessed images kept
+        """
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._cache = self._new_cache()
+        self.hits = 0
+        self.misses = 0
+
+    def _new_cache(self) -> _LRUCache:
+        return _LRUCache(
+            maxsize=self.max_bytes, getsizeof=lambda image: len(image.content)
+        )
+
+    @staticmethod
+    def key(
+        image_bytes: bytes, image_bounding_polys: Optional[List[OcrBoundingPoly]]
+    ) -> Tuple:
+        bounding_polys_key = None
+        if image_bounding_polys is not None:
+            bounding_polys_key = tuple(
+                tuple((vertex.x, vertex.y) for vertex in bounding_poly.vertices)
+                for bounding_poly in image_bounding_polys
+            )
+        return (
+            hashlib.blake2b(image_bytes, digest_size=16).digest(),
+            bounding_polys_key,
+        )
+
+    def get(self, key: Tuple) -> Optional[PreprocessedImage]:
+        with self._lock:
+            image = self._cache.get(key)
+            if image is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return image
+
+    def set(self, key: Tuple, image: PreprocessedImage):
+        if len(image.content) > self.max_bytes:
+            return
+        with self._lock:
+            self._cache[key] = image
+
+    def info(self) -> PreprocessedImagesCacheInfo:
+        with self._lock:
+            return PreprocessedImagesCacheInfo(
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self._cache.evictions,
+                maxsize=self.max_bytes,
+                currsize=self._cache.currsize,
+            )
+
+    def clear(self):
+        with self._lock:
+            self._cache = self._new_cache()
+            self.hits = 0
+            self.misses = 0
+
+
 class Ocr:
     def __init__(
         self,
         pixels_per_image: int = 640 * 480,
         google_image_format: str = GoogleImageFormat.JPEG,
+        batch_vision_requests: bool = True,
+        max_concurrent_images: int = 4,
+        preprocessed_images_cache_bytes: Optional[int] = None,
         # assume_image
     ):
-        self.client_vision = vision.ImageAnnotatorClient()
+        """
+        :param batch_vision_requests: This indicates whether to send all the images of
+            a call to batch to Google Vision at once rather than one by one
+        :param max_concurrent_images: The number of images of a call to batch that are
+            read, preprocessed and, when not batched, sent to Google Vision concurrently
+        :param preprocessed_images_cache_bytes: The total size of the preprocessed
+            images kept across calls, None for no cache
+        """
         self.pixels_per_image = pixels_per_image
         self.google_image_format = google_image_format
+        self.batch_vision_requests = batch_vision_requests
+        self.max_concurrent_images = max_concurrent_images
+        self.preprocessed_images_cache: Optional[PreprocessedImagesCache] = None
+        if preprocessed_images_cache_bytes:
+            self.preprocessed_images_cache = PreprocessedImagesCache(
+                max_bytes=preprocessed_images_cache_bytes
+            )
+        # shared by all the requests, its threads are only started when needed
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, max_concurrent_images), thread_name_prefix="ocr"
+        )
+
+    @property
+    def client_vision(self) -> vision.ImageAnnotatorClient:
+        # only created when an image is sent to Google Vision, requests with labels
+        # only never do
+        return get_vision_client()
 
     @property
     def google_image_extension(self):
@@ -101,17 +266,23 @@ class Ocr:
             image = self.get_image_from_bytes(image_bytes=image_bytes.getvalue())
         return image
 
-    def set_quality(self, image: Image):
-        width, height = image.size
+    def quality_size(self, size: Tuple[int, int]) -> Tuple[int, int]:
+        """Returns the size of an image of the given size once resized to about
+        pixels_per_image pixels, keeping its aspect ratio"""
+        width, height = size
         height_over_width = height / width
         new_width = int(math.sqrt(self.pixels_per_image / height_over_width))
         new_height = int(new_width * height_over_width)
-        return image.resize((new_width, new_height), Image.ANTIALIAS)
+        return new_width, new_height
+
+    def set_quality(self, image: Image):
+        return image.resize(self.quality_size(image.size), Image.ANTIALIAS)
 
     @staticmethod
-    def crop_image_with_bounding_poly(
-        image, image_bounding_polys: List[OcrBoundingPoly]
-    ):
+    def bounding_polys_box(
+        image_bounding_polys: List[OcrBoundingPoly],
+    ) -> Tuple[float, float, float, float]:
+        """Returns the (left, top, right, bottom) box around the bounding polys"""
         vertices = [
             vertex
             for image_bounding_poly in image_bounding_polys
@@ -121,11 +292,20 @@ class Ocr:
         left = min(vertices, key=lambda vertex: vertex.x).x
         bottom = max(vertices, key=lambda vertex: vertex.y).y
         right = max(vertices, key=lambda vertex: vertex.x).x
-        return image.crop((left, top, right, bottom))
+        return left, top, right, bottom
 
-    def rotate_image_with_bounding_polys(
-        self, image, image_bounding_polys: List[OcrBoundingPoly]
+    @staticmethod
+    def crop_image_with_bounding_poly(
+        image, image_bounding_polys: List[OcrBoundingPoly]
     ):
+        return image.crop(Ocr.bounding_polys_box(image_bounding_polys))
+
+    @staticmethod
+    def bounding_polys_transposition(
+        image_bounding_polys: List[OcrBoundingPoly],
+    ) -> Optional[int]:
+        """Returns the rotation that puts the text of the bounding polys straight,
+        None if it already is"""
         # bounding_polys are assumed to come from Google Vision and being ordered from
         # top of the label to bottom
 
@@ -133,14 +313,22 @@ class Ocr:
             bounding_poly.global_orientation for bounding_poly in image_bounding_polys
         ).most_common(1)[0]
         if most_common_global_orientation == GlobalOrientation.straight:
-            return image
+            return None
         elif most_common_global_orientation == GlobalOrientation.right:
-            return image.transpose(Image.ROTATE_90)
+            return Image.ROTATE_90
         elif most_common_global_orientation == GlobalOrientation.left:
-            return image.transpose(Image.ROTATE_270)
+            return Image.ROTATE_270
         else:
             raise NotImplementedError
 
+    def rotate_image_with_bounding_polys(
+        self, image, image_bounding_polys: List[OcrBoundingPoly]
+    ):
+        transposition = self.bounding_polys_transposition(image_bounding_polys)
+        if transposition is None:
+            return image
+        return image.transpose(transposition)
+
     def preprocess_with_bounding_polys(
         self, image, image_bounding_polys: List[OcrBoundingPoly]
     ):
@@ -164,7 +352,6 @@ class Ocr:
         return image
 
     @staticmethod
-    @lru_cache
     def get_image_from_bytes(image_bytes: List[bytes]):
         if "ISO Media" in magic.from_buffer(image_bytes):
             logger.warning(
@@ -180,6 +367,7 @@ class Ocr:
                 heif_file.mode,
                 heif_file.stride,
             )
+        # only decoded when used, possibly at a reduced scale
         return Image.open(io.BytesIO(image_bytes))
 
     def get_image_bytes(self, image: Image):
@@ -200,18 +388,168 @@ class Ocr:
         else:
             raise Exception("image_url or image_bytes must be provided to perform ocr")
 
+        preprocessed_image = self.read_and_preprocess(
+            image_bytes=image_bytes, image_bounding_polys=image_bounding_polys
+        )
+        return self.text_and_bounding_polys(
+            text_annotations=self.client_vision.text_detection(
+                image=vision.Image(content=preprocessed_image.content)
+            ).text_annotations,
+            preprocessed_image=preprocessed_image,
+        )
+
+    def batch(
+        self,
+        images_bytes: List[bytes],
+        images_bounding_polys: Optional[List[List[OcrBoundingPoly]]] = None,
+    ) -> List[Tuple[str, List[OcrBoundingPoly]]]:
+        """Same as calling the instance on each image, all the images being sent to
+        Google Vision at once, in as few requests as it accepts
+
+        :param images_bytes: The images to read the text of
+        :param images_bounding_polys: The bounding polys of the text of each image,
+            found by a previous call, to crop and rotate the image with
+        :returns: The text and the bounding polys of the words of each image, in order
+        """
+        if images_bounding_polys is None:
+            images_bounding_polys = [None] * len(images_bytes)
+        if not self.batch_vision_requests:
+            return self._map_images(
+                lambda image_bytes, image_bounding_polys: self(
+                    image_bytes=image_bytes, image_bounding_polys=image_bounding_polys
+                ),
+                images_bytes,
+                images_bounding_polys,
+            )
+        images = self._map_images(
+            self.read_and_preprocess, images_bytes, images_bounding_polys
+        )
+        responses = []
+        for chunk_start in range(0, len(images), MAX_IMAGES_PER_VISION_REQUEST):
+            chunk = images[chunk_start : chunk_start + MAX_IMAGES_PER_VISION_REQUEST]
+            responses += self.client_vision.batch_annotate_images(
+                requests=[
+                    vision.AnnotateImageRequest(
+                        image=vision.Image(content=preprocessed_image.content),
+                        features=[
+                            vision.Feature(type_=vision.Feature.Type.TEXT_DETECTION)
+                        ],
+                    )
+                    for preprocessed_image in chunk
+                ]
+            ).responses
+        labels_and_bounding_polys = []
+        for preprocessed_image, response in zip(images, responses):
+            if response.error.message:
+                logger.warning(
+                    f"Google Vision failed to annotate an image: "
+                    f"{response.error.message}"
+                )
+            labels_and_bounding_polys.append(
+                self.text_and_bounding_polys(
+                    text_annotations=response.text_annotations,
+                    preprocessed_image=preprocessed_image,
+                )
+            )
+        return labels_and_bounding_polys
+
+    def _map_images(self, func: Callable, *iterables: Iterable) -> List:
+        """Calls func on each image concurrently, the results being in the order of
+        the images and the first exception raised being raised again"""
+        iterables = [list(iterable) for iterable in iterables]
+        if self.max_concurrent_images <= 1 or len(iterables[0]) <= 1:
+            return list(map(func, *iterables))
+        return list(self._executor.map(func, *iterables))
+
+    def read_and_preprocess(
+        self,
+        image_bytes: bytes,
+        image_bounding_polys: Optional[List[OcrBoundingPoly]] = None,
+    ) -> PreprocessedImage:
+        """Same as _read_and_preprocess, the images already preprocessed being taken
+        from the cache"""
+        if self.preprocessed_images_cache is None:
+            return self._read_and_preprocess(image_bytes, image_bounding_polys)
+        key = self.preprocessed_images_cache.key(image_bytes, image_bounding_polys)
+        preprocessed_image = self.preprocessed_images_cache.get(key)
+        if preprocessed_image is None:
+            preprocessed_image = self._read_and_preprocess(
+                image_bytes, image_bounding_polys
+            )
+            self.preprocessed_images_cache.set(key, preprocessed_image)
+        return preprocessed_image
+
+    def _read_and_preprocess(
+        self,
+        image_bytes: bytes,
+        image_bounding_polys: Optional[List[OcrBoundingPoly]] = None,
+    ) -> PreprocessedImage:
+        """Same as preprocess on the image read from its bytes, in a single pipeline:
+        the image is decoded once, at a reduced scale when its format allows it,
+        cropped and resized before being rotated, and encoded once"""
         image = self.get_image_from_bytes(image_bytes=image_bytes)
-        logger.info(f"Got image with {image.size[0] * image.size[1]} pixels")
-        preprocessed_image = self.preprocess(
-            image=image, image_bounding_polys=image_bounding_polys
+        original_size = image.size
+        logger.info(f"Got image with {original_size[0] * original_size[1]} pixels")
+        box, transposition = (0, 0, *original_size), None
+        if image_bounding_polys is not None:
+            # rounded as when cropping
+            box = tuple(
+                int(round(coordinate))
+                for coordinate in self.bounding_polys_box(image_bounding_polys)
+            )
+            transposition = self.bounding_polys_transposition(image_bounding_polys)
+        box_size = (box[2] - box[0], box[3] - box[1])
+        # the same size as when resizing the rotated image
+        if transposition is None:
+            size = self.quality_size(box_size)
+        else:
+            size = self.quality_size(box_size[::-1])[::-1]
+
+        # a jpeg image is decoded at the smallest scale keeping the box larger than
+        # the size it is resized to, the box being scaled accordingly
+        image.draft(
+            image.mode,
+            (
+                math.ceil(original_size[0] * size[0] / box_size[0]),
+                math.ceil(original_size[1] * size[1] / box_size[1]),
+            ),
         )
-        detections = list(
-            self.client_vision.text_detection(
-                image=vision.Image(content=self.get_image_bytes(preprocessed_image))
-            ).text_annotations
+        if box != (0, 0, *original_size):
+            x_scale = image.size[0] / original_size[0]
+            y_scale = image.size[1] / original_size[1]
+            image = image.crop(
+                (
+                    round(box[0] * x_scale),
+                    round(box[1] * y_scale),
+                    round(box[2] * x_scale),
+                    round(box[3] * y_scale),
+                )
+            )
+        to_jpeg = self.google_image_format == GoogleImageFormat.JPEG
+        if to_jpeg and image.mode not in ("RGB", "L"):
+            # JPEG does not support transparency so convert RGBA to RGB, before
+            # resizing as palette images would not be smoothed
+            image = image.convert("RGB")
+        image = image.resize(size, Image.ANTIALIAS, reducing_gap=3.0)
+        if transposition is not None:
+            image = image.transpose(transposition)
+        return PreprocessedImage(
+            content=self.get_image_bytes(image),
+            size=image.size,
+            original_size=original_size,
         )
+
+    @staticmethod
+    def text_and_bounding_polys(
+        text_annotations, preprocessed_image: PreprocessedImage
+    ) -> Tuple[str, List[OcrBoundingPoly]]:
+        """Reads the text found by Google Vision in preprocessed_image and the
+        bounding polys of its words, as positions in the image it comes from"""
+        detections = list(text_annotations)
         if not detections:
             raise TextNotFound
+        width_ratio = preprocessed_image.original_size[0] / preprocessed_image.size[0]
+        height_ratio = preprocessed_image.original_size[1] / preprocessed_image.size[1]
         # x --> columns towards right
         # y --> lines towards down
         return (
@@ -219,10 +557,7 @@ class Ocr:
             [
                 OcrBoundingPoly(
                     vertices=[
-                        Vertex(
-                            x=vertex.x / preprocessed_image.size[0] * image.size[0],
-                            y=vertex.y / preprocessed_image.size[1] * image.size[1],
-                        )
+                        Vertex(x=vertex.x * width_ratio, y=vertex.y * height_ratio)
                         for vertex in detection.bounding_poly.vertices
                     ]
                 )
@@ -231,8 +566,12 @@ class Ocr:
         )
 
 
+@lru_cache()
 def get_ocr():
     return Ocr(
         pixels_per_image=Config.Ocr.pixels_per_image,
         google_image_format=Config.Ocr.google_image_format,
+        batch_vision_requests=Config.Ocr.batch_vision_requests,
+        max_concurrent_images=Config.Ocr.max_concurrent_images,
+        preprocessed_images_cache_bytes=Config.Ocr.preprocessed_images_cache_bytes,
     )
@@ -1,3 +1,14 @@
-def chunks(elems, chunk_size):
-    chunk_size = max(1, chunk_size)
-    return list(elems[i : i + chunk_size] for i in range(0, len(elems), chunk_size))
+def chunks_by_weight(elems, weights, n_chunks):
+    """Splits elems, in order, into at most n_chunks chunks of about the same weight"""
+    n_chunks = max(1, min(n_chunks, len(elems)))
+    chunk_weight = sum(weights) / n_chunks
+    chunks, chunk, weight = [], [], 0
+    for elem, elem_weight in zip(elems, weights):
+        chunk.append(elem)
+        weight += elem_weight
+        if weight >= chunk_weight and len(chunks) < n_chunks - 1:
+            chunks.append(chunk)
+            chunk, weight = [], 0
+    if chunk:
+        chunks.append(chunk)
+    return chunks
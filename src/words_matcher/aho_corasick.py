@@ -0,0 +1,69 @@
+from collections import deque
+from typing import Dict, List, Sequence, Tuple
+
+
+class AhoCorasick:
+    """An Aho-Corasick automaton finding all the occurrences of many words in a text
+    in a single pass over it"""
+
+    def __init__(self, words: Sequence[str]):
+        """
+        :param words: The words to look for, empty words are ignored
+        """
+        self.words = list(words)
+        # goto transitions, failure links and the positions of the words ending at
+        # each state, state 0 being the root
+        self._transitions: List[Dict[str, int]] = [{}]
+        self._failures: List[int] = [0]
+        self._outputs: List[List[int]] = [[]]
+        for word_idx, word in enumerate(self.words):
+            if word:
+                self._add(word, word_idx)
+        self._link()
+
+    def _add(self, word: str, word_idx: int):
+        state = 0
+        for char in word:
+            if char not in self._transitions[state]:
+                self._transitions.append({})
+                self._failures.append(0)
+                self._outputs.append([])
+                self._transitions[state][char] = len(self._transitions) - 1
+            state = self._transitions[state][char]
+        self._outputs[state].append(word_idx)
+
+    def _link(self):
+        queue = deque(self._transitions[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._transitions[state].items():
+                queue.append(next_state)
+                failure = self._failures[state]
+                while failure and char not in self._transitions[failure]:
+                    failure = self._failures[failure]
+                self._failures[next_state] = self._transitions[failure].get(char, 0)
+                if self._failures[next_state] == next_state:
+                    self._failures[next_state] = 0
+                # a state also outputs the words ending at its longest proper suffix
+                self._outputs[next_state] = (
+                    self._outputs[next_state]
+                    + self._outputs[self._failures[next_state]]
+                )
+
+    def find_all(self, text: str) -> List[Tuple[int, int, int]]:
+        """Finds all the occurrences, possibly overlapping, of the words in text
+
+        :param text: The text to look into
+        :returns: The (start, end, word position) of each occurrence, end excluded
+        """
+        occurrences = []
+        state = 0
+        for char_idx, char in enumerate(text):
+            while state and char not in self._transitions[state]:
+                state = self._failures[state]
+            state = self._transitions[state].get(char, 0)
+            for word_idx in self._outputs[state]:
+                occurrences.append(
+                    (char_idx + 1 - len(self.words[word_idx]), char_idx + 1, word_idx)
+                )
+        return occurrences
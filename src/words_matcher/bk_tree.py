@@ -0,0 +1,95 @@
+from typing import Dict, List, Optional, Sequence
+
+from src.words_matcher.similarity import lcs_length, min_common_subsequence_length
+
+
+def indel_distance(ref_word: str, word: str) -> int:
+    """The number of characters to insert and delete to turn one word into the other"""
+    return len(ref_word) + len(word) - 2 * lcs_length(ref_word, word)
+
+
+def max_indel_distance(
+    ref_word_length: int, word_length: int, threshold: float
+) -> Optional[int]:
+    """Returns the largest indel distance two words of the given lengths can be apart
+    while their similarity still possibly reaches threshold, or None if it never can"""
+    min_lcs_length = min_common_subsequence_length(
+        ref_word_length, word_length, threshold
+    )
+    if min_lcs_length is None:
+        return None
+    return ref_word_length + word_length - 2 * min_lcs_length
+
+
+class BKTreeNode:
+    __slots__ = ("word", "ref_words_idxs", "children")
+
+    def __init__(self, word: str, ref_word_idx: int):
+        self.word = word
+        # several referential words may share the same standardized spelling
+        self.ref_words_idxs: List[int] = [ref_word_idx]
+        self.children: Dict[int, "BKTreeNode"] = {}
+
+
+class BKTree:
+    """A Burkhard-Keller tree over referential words with the indel distance
+
+    It finds all the referential words within an edit distance of a word by visiting
+    only the subtrees that the triangle inequality does not rule out, which suits
+    OCR noise made of one or two characters edits. The distance radius of a query is
+    derived from the similarity threshold so that no referential word able to reach
+    it is left out.
+    """
+
+    def __init__(self, ref_words: Sequence[str], ref_words_idxs: Sequence[int]):
+        """
+        :param ref_words: The standardized referential words
+        :param ref_words_idxs: The positions in ref_words of the words to index
+        """
+        self.root: Optional[BKTreeNode] = None
+        self.ref_words_lengths = set()
+        for ref_word_idx in ref_words_idxs:
+            self.add(ref_words[ref_word_idx], ref_word_idx)
+
+    def add(self, ref_word: str, ref_word_idx: int):
+        self.ref_words_lengths.add(len(ref_word))
+        if self.root is None:
+            self.root = BKTreeNode(ref_word, ref_word_idx)
+            return
+        node = self.root
+        while True:
+            distance = indel_distance(node.word, ref_word)
+            if distance == 0:
+                node.ref_words_idxs.append(ref_word_idx)
+                return
+            if distance not in node.children:
+                node.children[distance] = BKTreeNode(ref_word, ref_word_idx)
+                return
+            node = node.children[distance]
+
+    def candidates(self, word: str, threshold: float) -> List[int]:
+        """Returns the positions of the referential words that may reach threshold"""
+        max_distances = [
+            max_distance
+            for max_distance in (
+                max_indel_distance(ref_word_length, len(word), threshold)
+                for ref_word_length in self.ref_words_lengths
+            )
+            if max_distance is not None
+        ]
+        if self.root is None or not max_distances:
+            return []
+        radius = max(max_distances)
+        candidates = []
+        nodes = [self.root]
+        while nodes:
+            node = nodes.pop()
+            distance = indel_distance(node.word, word)
+            if distance <= radius:
+                max_distance = max_indel_distance(len(node.word), len(word), threshold)
+                if max_distance is not None and distance <= max_distance:
+                    candidates += node.ref_words_idxs
+            for child_distance, child in node.children.items():
+                if distance - radius <= child_distance <= distance + radius:
+                    nodes.append(child)
+        return sorted(candidates)
@@ -1,6 +1,9 @@
 from dataclasses import dataclass
-from functools import cached_property
-from typing import List
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from src.words_matcher.referential import CompiledReferential
 
 
 @dataclass
@@ -9,14 +12,16 @@ class Match:
     matching_sub_sentence: str
     score: float
     sentence: str
+    # the position of the first and last characters of the matching sub sentence in
+    # sentence, looked for in sentence when not given
+    start: Optional[int] = None
+    end: Optional[int] = None
 
-    @cached_property
-    def start(self):
-        return self.sentence.find(self.matching_sub_sentence)
-
-    @cached_property
-    def end(self):
-        return self.start + len(self.matching_sub_sentence) - 1
+    def __post_init__(self):
+        if self.start is None:
+            self.start = self.sentence.find(self.matching_sub_sentence)
+        if self.end is None:
+            self.end = self.start + len(self.matching_sub_sentence) - 1
 
 
 class MatchFilter:
@@ -24,23 +29,183 @@ class MatchFilter:
     longest = "longest"
 
 
-@dataclass
-class OverlappingMatches:
-    left_bound: int
-    right_bound: int
-    matches: List[Match]
-
-    def match_overlaps(self, match: Match):
-        if (
-            self.left_bound <= match.start <= self.right_bound
-            or self.left_bound <= match.end <= self.right_bound
-        ):
-            return True
-        return False
-
-    def add(self, match: Match):
-        if not self.match_overlaps(match):
-            raise Exception
-        self.matches.append(match)
-        self.left_bound = min(self.left_bound, match.start)
-        self.right_bound = max(self.right_bound, match.end)
+class MatchBatch:
+    """The matches found in a sentence, stored as parallel arrays with one row per
+    match
+
+    Filters work on the arrays, in the order of the rows, and Match objects are only
+    built for the rows left, with to_matches.
+    """
+
+    __slots__ = (
+        "sentence",
+        "referential",
+        "sub_sentences",
+        "entries_idxs",
+        "sub_sentences_idxs",
+        "starts",
+        "ends",
+        "scores",
+    )
+
+    def __init__(
+        self,
+        sentence: str,
+        referential: CompiledReferential,
+        sub_sentences: Sequence[str],
+        entries_idxs: np.ndarray,
+        sub_sentences_idxs: np.ndarray,
+        starts: np.ndarray,
+        ends: np.ndarray,
+        scores: np.ndarray,
+    ):
+        """
+        :param sentence: The standardized sentence
+        :param referential: The compiled referential the entries positions refer to
+        :param sub_sentences: The sub sentences the matches may have been found in
+        :param entries_idxs: The position of the referential entry of each match
+        :param sub_sentences_idxs: The position in sub_sentences of each match
+        :param starts: The position in sentence of the first character of each match
+        :param ends: The position in sentence of the last character of each match
+        :param scores: The similarity score of each match
+        """
+        self.sentence = sentence
+        self.referential = referential
+        self.sub_sentences = sub_sentences
+        self.entries_idxs = entries_idxs
+        self.sub_sentences_idxs = sub_sentences_idxs
+        self.starts = starts
+        self.ends = ends
+        self.scores = scores
+
+    def __len__(self) -> int:
+        return len(self.entries_idxs)
+
+    @staticmethod
+    def concatenate(
+        sentence: str, match_batches: Sequence["MatchBatch"], offsets: Sequence[int]
+    ) -> "MatchBatch":
+        """Merges the matches found in several parts of sentence
+
+        :param sentence: The standardized sentence the parts are taken from
+        :param match_batches: The matches of each part, found with the same referential
+        :param offsets: The position in sentence of each part
+        :returns: The matches, ordered as the referential and then as sentence
+        """
+        entries_idxs, sub_sentences_idxs, starts, ends, scores = [], [], [], [], []
+        sub_sentences = []
+        for match_batch, offset in zip(match_batches, offsets):
+            entries_idxs.append(match_batch.entries_idxs)
+            sub_sentences_idxs.append(
+                match_batch.sub_sentences_idxs + len(sub_sentences)
+            )
+            sub_sentences += match_batch.sub_sentences
+            starts.append(match_batch.starts + offset)
+            ends.append(match_batch.ends + offset)
+            scores.append(match_batch.scores)
+        entries_idxs = np.concatenate([np.zeros(0, dtype=np.int64), *entries_idxs])
+        starts = np.concatenate([np.zeros(0, dtype=np.int64), *starts])
+        match_batch = MatchBatch(
+            sentence=sentence,
+            referential=match_batches[0].referential,
+            sub_sentences=sub_sentences,
+            entries_idxs=entries_idxs,
+            sub_sentences_idxs=np.concatenate(
+                [np.zeros(0, dtype=np.int64), *sub_sentences_idxs]
+            ),
+            starts=starts,
+            ends=np.concatenate([np.zeros(0, dtype=np.int64), *ends]),
+            scores=np.concatenate([np.zeros(0, dtype=np.float64), *scores]),
+        )
+        return match_batch.take(np.lexsort((starts, entries_idxs)))
+
+    def take(self, rows: np.ndarray) -> "MatchBatch":
+        return MatchBatch(
+            sentence=self.sentence,
+            referential=self.referential,
+            sub_sentences=self.sub_sentences,
+            entries_idxs=self.entries_idxs[rows],
+            sub_sentences_idxs=self.sub_sentences_idxs[rows],
+            starts=self.starts[rows],
+            ends=self.ends[rows],
+            scores=self.scores[rows],
+        )
+
+    def with_referential(
+        self, referential: CompiledReferential, entries_offset: int = 0
+    ) -> "MatchBatch":
+        """Refers the matches to referential, whose entries from entries_offset on are
+        the entries of the referential the matches have been found with"""
+        return MatchBatch(
+            sentence=self.sentence,
+            referential=referential,
+            sub_sentences=self.sub_sentences,
+            entries_idxs=self.entries_idxs + entries_offset,
+            sub_sentences_idxs=self.sub_sentences_idxs,
+            starts=self.starts,
+            ends=self.ends,
+            scores=self.scores,
+        )
+
+    def with_tag(self, tag: Optional[str]) -> "MatchBatch":
+        """Keeps the matches of the referential words with tag"""
+        return self.take(
+            np.nonzero(self.referential.tag_mask(tag)[self.entries_idxs])[0]
+        )
+
+    def best_per_word(self) -> "MatchBatch":
+        """Keeps the best match of each referential word, the first one on ties, in the
+        order each word is first found"""
+        if not len(self):
+            return self
+        words_ids = self.referential.words_ids[self.entries_idxs]
+        rows = np.arange(len(self))
+        order = np.lexsort((rows, -self.scores, words_ids))
+        _, best_rows_positions = np.unique(words_ids[order], return_index=True)
+        _, first_rows = np.unique(words_ids, return_index=True)
+        return self.take(order[best_rows_positions][np.argsort(first_rows)])
+
+    def without_overlaps(self, filter_on: str = MatchFilter.longest) -> "MatchBatch":
+        """Keeps the longest, or best, match of each group of overlapping matches, the
+        first one on ties, in the order of the rows
+
+        Matches are swept in order of position, a group lasting as long as the next
+        match starts before the end of the group.
+        """
+        if filter_on == MatchFilter.longest:
+            keys = self.referential.words_lengths[self.entries_idxs]
+        elif filter_on == MatchFilter.best:
+            keys = self.scores
+        else:
+            raise NotImplementedError
+        if not len(self):
+            return self
+        order = np.argsort(self.starts, kind="stable")
+        groups_ends = np.maximum.accumulate(self.ends[order])
+        starts_group = np.ones(len(self), dtype=bool)
+        starts_group[1:] = self.starts[order][1:] > groups_ends[:-1]
+        groups = np.empty(len(self), dtype=np.int64)
+        groups[order] = np.cumsum(starts_group)
+        rows = np.arange(len(self))
+        best_rows = np.lexsort((rows, -keys, groups))
+        _, best_rows_positions = np.unique(groups[best_rows], return_index=True)
+        return self.take(np.sort(best_rows[best_rows_positions]))
+
+    def to_matches(self) -> List[Match]:
+        return [
+            Match(
+                found_word=self.referential[entry_idx].word,
+                matching_sub_sentence=self.sub_sentences[sub_sentence_idx],
+                score=score,
+                sentence=self.sentence,
+                start=start,
+                end=end,
+            )
+            for entry_idx, sub_sentence_idx, start, end, score in zip(
+                self.entries_idxs.tolist(),
+                self.sub_sentences_idxs.tolist(),
+                self.starts.tolist(),
+                self.ends.tolist(),
+                self.scores.tolist(),
+            )
+        ]
@@ -0,0 +1,153 @@
+import atexit
+import collections
+import logging
+import multiprocessing
+import threading
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from src.utils import chunks_by_weight
+
+logger = logging.getLogger(__name__)
+
+# below these amounts of work per chunk, the cost of shipping a chunk to a worker
+# process outweighs the computation and the work is done serially
+MIN_CHARS_PER_CHUNK = 1024
+MIN_PAIRS_PER_CHUNK = 256
+# chunks per worker process, so that uneven chunks do not leave processes idle
+CHUNKS_PER_PROCESS = 4
+
+# the words matcher and compiled referentials shipped once to each worker process
+_worker_state: Dict[str, Any] = {}
+
+
+def _initialize_worker(words_matcher, referentials: Dict[int, Any]):
+    _worker_state["words_matcher"] = words_matcher
+    _worker_state["referentials"] = referentials
+
+
+def _find_words_in_sentences(sentences: List[str], referential_key: int, kwargs):
+    words_matcher = _worker_state["words_matcher"]
+    return words_matcher._find_words_in_sentences(
+        sentences,
+        words_matcher,
+        _worker_state["referentials"][referential_key],
+        **kwargs,
+    )
+
+
+class WorkerPool:
+    """A pool of worker processes started once and reused across calls
+
+    The words matcher and its compiled referentials are sent to the worker processes
+    when they start instead of with every chunk of work, so that a call only ships its
+    sentences. The pool is restarted, once, when a words matcher or a referential it
+    has not been started with is used.
+    """
+
+    def __init__(self, processes: Optional[int] = None, max_referentials: int = 4):
+        """
+        :param processes: The number of worker processes, defaults to the cpu count
+        :param max_referentials: The number of referentials kept in the workers
+        """
+        self.processes = processes or multiprocessing.cpu_count()
+        self.max_referentials = max_referentials
+        self._lock = threading.Lock()
+        self._pool = None
+        self._words_matcher = None
+        # the referentials the workers hold, keyed by their id in this process,
+        # holding them here keeps the ids from being reused
+        self._referentials: Dict[int, Any] = collections.OrderedDict()
+
+    def _map(self, func, iterable, words_matcher=None, referential=None) -> List[Any]:
+        with self._lock:
+            restart = self._pool is None
+            if words_matcher is not None and words_matcher is not self._words_matcher:
+                self._words_matcher = words_matcher
+                restart = True
+            if referential is not None and id(referential) not in self._referentials:
+                self._referentials[id(referential)] = referential
+                while len(self._referentials) > self.max_referentials:
+                    self._referentials.popitem(last=False)
+                restart = True
+            if restart:
+                if self._pool is not None:
+                    # running tasks are left to finish on the previous workers, which
+                    # are then joined in the background so that they do not linger
+                    self._pool.close()
+                    threading.Thread(
+                        target=self._pool.join, name="words-matcher-pool-join"
+                    ).start()
+                logger.info(
+                    f"Starting a pool of {self.processes} processes for the words"
+                    f" matcher with {len(self._referentials)} referentials"
+                )
+                self._pool = multiprocessing.Pool(
+                    processes=self.processes,
+                    initializer=_initialize_worker,
+                    initargs=(self._words_matcher, dict(self._referentials)),
+                )
+            # submitted while holding the lock so that another call cannot close
+            # the pool in between, the results are then waited for without it
+            results = self._pool.starmap_async(func, iterable)
+        return results.get()
+
+    def n_chunks(self, work: int, min_work_per_chunk: int) -> int:
+        """Returns how many chunks to split work into, 1 meaning to do it serially"""
+        if self.processes <= 1:
+            return 1
+        return min(self.processes * CHUNKS_PER_PROCESS, work // min_work_per_chunk)
+
+    def find_words_in_sentences(
+        self, words_matcher, referential, sentences: Sequence[str], **kwargs
+    ) -> Optional[List[Any]]:
+        """Runs words_matcher._find_words_in_sentences over chunks of sentences
+
+        :returns: The matches per sentence or None if the work is too small to be
+            worth parallelizing
+        """
+        weights = [len(str(sentence)) + 1 for sentence in sentences]
+        n_chunks = self.n_chunks(sum(weights), MIN_CHARS_PER_CHUNK)
+        if n_chunks <= 1:
+            return None
+        results = self._map(
+            _find_words_in_sentences,
+            [
+                (chunk, id(referential), kwargs)
+                for chunk in chunks_by_weight(list(sentences), weights, n_chunks)
+            ],
+            words_matcher=words_matcher,
+            referential=referential,
+        )
+        return [matches for chunk_matches in results for matches in chunk_matches]
+
+    def map_pairs(
+        self, func: Callable[[List[Any]], List[Any]], pairs: Sequence[Any]
+    ) -> Optional[List[Any]]:
+        """Runs func over chunks of pairs
+
+        :returns: The concatenated results or None if the work is too small to be
+            worth parallelizing
+        """
+        n_chunks = self.n_chunks(len(pairs), MIN_PAIRS_PER_CHUNK)
+        if n_chunks <= 1:
+            return None
+        results = self._map(
+            func,
+            [
+                (chunk,)
+                for chunk in chunks_by_weight(list(pairs), [1] * len(pairs), n_chunks)
+            ],
+        )
+        return [result for chunk_results in results for result in chunk_results]
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool.join()
+                self._pool = None
+
+
+# one pool per process of the application, started on first use
+worker_pool = WorkerPool()
+atexit.register(worker_pool.close)
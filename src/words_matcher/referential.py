@@ -0,0 +1,149 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict, FrozenSet, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.words_matcher.aho_corasick import AhoCorasick
+from src.words_matcher.scripts import text_scripts
+from src.words_matcher.token_trie import TokenTrie
+
+
+class CandidateIndexType:
+    trigram = "trigram"
+    bk_tree = "bk_tree"
+
+
+@dataclass(frozen=True)
+class ReferentialEntry:
+    # the spelling as given in the referential, e.g "Hong Kong"
+    word: str
+    # the spelling once standardized by the words matcher, e.g "hong kong"
+    standardized: str
+    # the standardized spelling once tokenized, e.g ("hong", "kong")
+    tokens: Tuple[str, ...]
+    # the group the word belongs to when several referentials are looked for at once,
+    # e.g "country"
+    tag: Optional[str] = None
+    n_tokens: int = field(init=False)
+    length: int = field(init=False)
+    # the writing systems of the standardized spelling, e.g {"LATIN"}, telling apart
+    # the spellings of a word in languages written differently
+    scripts: FrozenSet[str] = field(init=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, "n_tokens", len(self.tokens))
+        object.__setattr__(self, "length", len(self.standardized))
+        object.__setattr__(self, "scripts", text_scripts(self.standardized))
+
+
+class CompiledReferential:
+    """A referential whose words have been standardized and tokenized once and for all
+
+    Instances are meant to be built with `WordsMatcher.compile_referential` and reused
+    across calls to `WordsMatcher.find_words_in_sentences`.
+    """
+
+    def __init__(self, entries: Sequence[ReferentialEntry], tokenization_type: str):
+        self.entries: Tuple[ReferentialEntry, ...] = tuple(entries)
+        # the tokenization the entries have been built with, a words matcher with
+        # another tokenization would not produce comparable sub sentences
+        self.tokenization_type = tokenization_type
+        # the positions of the entries grouped by their number of tokens, in order of
+        # appearance, so that n-grams of a given length are built once per sentence
+        self.entries_idxs_by_n_tokens: Dict[int, List[int]] = {}
+        for entry_idx, entry in enumerate(self.entries):
+            self.entries_idxs_by_n_tokens.setdefault(entry.n_tokens, []).append(
+                entry_idx
+            )
+
+        self.standardized_words: Tuple[str, ...] = tuple(
+            entry.standardized for entry in self.entries
+        )
+        # per entry arrays used to filter the matches of a sentence all at once: the
+        # number of tokens, the length of the word and the position of the first
+        # entry with the same word, matches being told apart by their word
+        self.entries_n_tokens = np.array(
+            [entry.n_tokens for entry in self.entries], dtype=np.int64
+        )
+        self.words_lengths = np.array(
+            [len(entry.word) for entry in self.entries], dtype=np.int64
+        )
+        first_entry_idx_by_word: Dict[str, int] = {}
+        self.words_ids = np.array(
+            [
+                first_entry_idx_by_word.setdefault(entry.word, entry_idx)
+                for entry_idx, entry in enumerate(self.entries)
+            ],
+            dtype=np.int64,
+        )
+        # the distinct tags of the entries, in order of appearance, and the position
+        # in tags of the tag of each entry
+        self.tags: List[Optional[str]] = []
+        self.entries_tags_ids: Tuple[int, ...] = tuple(
+            self._tag_id(entry.tag) for entry in self.entries
+        )
+        self._tags_masks: Dict[Optional[str], np.ndarray] = {}
+        self._scripts_masks: Dict[FrozenSet[str], np.ndarray] = {}
+        # the candidate indexes built over the entries of each number of tokens,
+        # keyed by index type and number of tokens, built on first use
+        self.candidate_indexes: Dict[Tuple[str, int], Any] = {}
+        self._exact_matcher: Optional[AhoCorasick] = None
+        self._token_trie: Optional[TokenTrie] = None
+
+    def _tag_id(self, tag: Optional[str]) -> int:
+        if tag not in self.tags:
+            self.tags.append(tag)
+        return self.tags.index(tag)
+
+    def tag_mask(self, tag: Optional[str]) -> np.ndarray:
+        """Tells for each entry whether it has tag"""
+        if tag not in self._tags_masks:
+            self._tags_masks[tag] = np.array(
+                [entry.tag == tag for entry in self.entries], dtype=bool
+            )
+        return self._tags_masks[tag]
+
+    def scripts_mask(self, scripts: FrozenSet[str]) -> np.ndarray:
+        """Tells for each entry whether it is only written with some of scripts"""
+        if scripts not in self._scripts_masks:
+            self._scripts_masks[scripts] = np.array(
+                [entry.scripts <= scripts for entry in self.entries], dtype=bool
+            )
+        return self._scripts_masks[scripts]
+
+    @property
+    def exact_matcher(self) -> AhoCorasick:
+        """The automaton finding the exact occurrences of the standardized words,
+        whose word positions are the entries positions"""
+        if self._exact_matcher is None:
+            self._exact_matcher = AhoCorasick(self.standardized_words)
+        return self._exact_matcher
+
+    @property
+    def token_trie(self) -> TokenTrie:
+        """The trie over the tokens of the entries made of several tokens"""
+        if self._token_trie is None:
+            self._token_trie = TokenTrie(
+                ref_words=self.standardized_words,
+                ref_words_tokens=[entry.tokens for entry in self.entries],
+                ref_words_idxs=[
+                    entry_idx
+                    for n_tokens, entries_idxs in self.entries_idxs_by_n_tokens.items()
+                    if n_tokens > 1
+                    for entry_idx in entries_idxs
+                ],
+            )
+        return self._token_trie
+
+    @property
+    def words(self) -> List[str]:
+        return [entry.word for entry in self.entries]
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __iter__(self) -> Iterator[ReferentialEntry]:
+        return iter(self.entries)
+
+    def __getitem__(self, idx: int) -> ReferentialEntry:
+        return self.entries[idx]
@@ -0,0 +1,17 @@
+import unicodedata
+from functools import lru_cache
+from typing import FrozenSet
+
+
+@lru_cache(maxsize=4096)
+def char_script(char: str) -> str:
+    """Returns the writing system of a letter as the first word of its unicode name,
+    e.g "LATIN" for "é", "CYRILLIC" for "х" or "CJK" for "棉"
+    """
+    return unicodedata.name(char, "").split(" ", 1)[0]
+
+
+def text_scripts(text: str) -> FrozenSet[str]:
+    """Returns the writing systems of the letters of text, digits, punctuation and
+    whitespaces not belonging to any"""
+    return frozenset(char_script(char) for char in set(text) if char.isalpha())
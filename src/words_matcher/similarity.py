@@ -0,0 +1,281 @@
+import difflib
+import math
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+class SimilarityType:
+    difflib = "difflib"
+    # the indel similarity, 2 * lcs / (m + n), and not a levenshtein ratio: a
+    # substitution counts as a deletion and an insertion
+    indel_np = "indel_np"
+
+
+def min_common_subsequence_length(
+    ref_word_length: int, word_length: int, threshold: float
+) -> Optional[int]:
+    """Returns the smallest longest common subsequence length two words of the given
+    lengths must have for 2 * lcs / (total length) to reach threshold, or None if no
+    length is enough
+
+    Difflib ratio and indel similarity both have that form, with the number of matching
+    characters being at most the longest common subsequence length, so this bound holds
+    for both of them.
+    """
+    length = ref_word_length + word_length
+    if not length:
+        return 0
+    lcs_length = max(0, math.ceil(threshold * length / 2))
+    # the bound is compared the same way scores are, to be exact despite rounding
+    while lcs_length > 0 and 2.0 * (lcs_length - 1) / length >= threshold:
+        lcs_length -= 1
+    while 2.0 * lcs_length / length < threshold:
+        lcs_length += 1
+    if lcs_length > min(ref_word_length, word_length):
+        return None
+    return lcs_length
+
+
+class DifflibScorer:
+    """Computes difflib ratios between one sub sentence and many referential words
+
+    The sub sentence is the second sequence of a single SequenceMatcher so that difflib
+    builds its b2j and full b count tables once for all the referential words it is
+    compared to. The referential word must stay the first sequence: difflib ratio is
+    not symmetric, and swapping the sequences could change the matches.
+
+    When pruning, the length ratio and then the quick_ratio upper bounds are checked
+    before the exact ratio, and the score of a pair that cannot reach the threshold is
+    not computed. Every pair that reaches the threshold gets its exact ratio so that
+    pruning does not change the matches.
+    """
+
+    def __init__(self, threshold: float, prune: bool = True):
+        self.threshold = threshold
+        self.prune = prune
+        self._sequence_matcher = difflib.SequenceMatcher(None)
+        self._sub_sentence_length = 0
+
+    def set_sub_sentence(self, sub_sentence: str):
+        self._sequence_matcher.set_seq2(sub_sentence)
+        self._sub_sentence_length = len(sub_sentence)
+
+    def score(self, ref_word: str) -> Optional[float]:
+        """Returns the ratio between ref_word and the current sub sentence
+
+        :param ref_word: The standardized referential word
+        :returns: The difflib ratio or None if pruning proved it below the threshold
+        """
+        if self.prune:
+            # same computation as real_quick_ratio without setting the sequence
+            ref_word_length = len(ref_word)
+            length = ref_word_length + self._sub_sentence_length
+            if (
+                length
+                and 2.0 * min(ref_word_length, self._sub_sentence_length) / length
+                < self.threshold
+            ):
+                return None
+        self._sequence_matcher.set_seq1(ref_word)
+        if self.prune and self._sequence_matcher.quick_ratio() < self.threshold:
+            return None
+        return self._sequence_matcher.ratio()
+
+    def score_pairs(
+        self,
+        ref_words: Sequence[str],
+        sub_sentences: Sequence[str],
+        candidates: Sequence[Sequence[int]],
+    ) -> List[Tuple[int, int, float]]:
+        """Scores each sub sentence against its candidate referential words
+
+        :param ref_words: The standardized referential words
+        :param sub_sentences: The sub sentences to score
+        :param candidates: For each sub sentence, the positions in ref_words of the
+            referential words to compare it to
+        :returns: The (ref word position, sub sentence position, score) of the pairs
+            whose score reaches the threshold
+        """
+        found = []
+        for sub_sentence_idx, sub_sentence in enumerate(sub_sentences):
+            if not candidates[sub_sentence_idx]:
+                continue
+            self.set_sub_sentence(sub_sentence)
+            for ref_word_idx in candidates[sub_sentence_idx]:
+                score = self.score(ref_words[ref_word_idx])
+                if score is not None and score >= self.threshold:
+                    found.append((ref_word_idx, sub_sentence_idx, score))
+        return found
+
+
+# number of set bits of every byte value
+_POPCOUNT_TABLE = np.array(
+    [bin(byte).count("1") for byte in range(256)], dtype=np.int64
+)
+_WORD_BITS = 64
+
+
+def _popcount(values: np.ndarray) -> np.ndarray:
+    return _POPCOUNT_TABLE[values.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def encode_words(words: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Encodes words as a matrix of code points padded with -1
+
+    :param words: The words to encode
+    :returns: The (number of words, longest word length) matrix of code points
+    :returns: The length of each word
+    """
+    lengths = np.fromiter(
+        (len(word) for word in words), dtype=np.int64, count=len(words)
+    )
+    codes = np.full((len(words), lengths.max(initial=0)), -1, dtype=np.int64)
+    for word_idx, word in enumerate(words):
+        codes[word_idx, : lengths[word_idx]] = np.frombuffer(
+            word.encode("utf-32-le"), dtype=np.uint32
+        )
+    return codes, lengths
+
+
+def lcs_length(ref_word: str, word: str) -> int:
+    """Computes the longest common subsequence length between two words
+
+    The bit parallel algorithm is run on python integers, which have no width limit.
+    """
+    match_masks: Dict[str, int] = {}
+    for char_idx, char in enumerate(ref_word):
+        match_masks[char] = match_masks.get(char, 0) | (1 << char_idx)
+    mask = (1 << len(ref_word)) - 1
+    bits = mask
+    for char in word:
+        matched = bits & match_masks.get(char, 0)
+        bits = ((bits + matched) | (bits - matched)) & mask
+    return len(ref_word) - bin(bits).count("1")
+
+
+def lcs_lengths_np(ref_word: str, codes: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """Computes the longest common subsequence length between ref_word and many words
+
+    The bit parallel algorithm of Hyyrö is run on all the words at once, with one
+    64 bits integer per word holding the state of all ref_word characters.
+
+    :param ref_word: The word to compare to all words
+    :param codes: The encoded words, as returned by encode_words
+    :param lengths: The length of each encoded word
+    :returns: The longest common subsequence length for each word
+    """
+    # the rare referential words longer than a machine word are compared one by one
+    if len(ref_word) > _WORD_BITS:
+        words = [
+            "".join(map(chr, word_codes[:length]))
+            for word_codes, length in zip(codes, lengths)
+        ]
+        return np.array([lcs_length(ref_word, word) for word in words], dtype=np.int64)
+
+    ref_chars, inverse = np.unique(
+        np.frombuffer(ref_word.encode("utf-32-le"), dtype=np.uint32).astype(np.int64),
+        return_inverse=True,
+    )
+    # bit i of the match mask of a character is set when ref_word[i] is that character
+    ref_chars_masks = np.zeros(len(ref_chars), dtype=np.uint64)
+    for char_idx, ref_char_idx in enumerate(inverse.reshape(-1)):
+        ref_chars_masks[ref_char_idx] |= np.uint64(1 << char_idx)
+    positions = np.clip(
+        np.searchsorted(ref_chars, codes), 0, max(len(ref_chars) - 1, 0)
+    )
+    if len(ref_chars):
+        matches_masks = np.where(
+            ref_chars[positions] == codes, ref_chars_masks[positions], np.uint64(0)
+        )
+    else:
+        matches_masks = np.zeros(codes.shape, dtype=np.uint64)
+
+    # padding characters have an empty match mask and leave the state unchanged
+    bits = np.full(len(codes), np.iinfo(np.uint64).max, dtype=np.uint64)
+    for column in range(codes.shape[1]):
+        matched = bits & matches_masks[:, column]
+        bits = (bits + matched) | (bits - matched)
+    mask = np.uint64((1 << len(ref_word)) - 1)
+    return len(ref_word) - _popcount(bits & mask)
+
+
+def indel_similarities_np(
+    ref_word: str, codes: np.ndarray, lengths: np.ndarray
+) -> np.ndarray:
+    """Computes the normalized indel similarity between ref_word and many words
+
+    The similarity is 2 * lcs / (len(ref_word) + len(word)), which is 1 minus the
+    insertion and deletion edit distance over the total length. It is on the same
+    scale as the difflib ratio and never below it, since difflib matching blocks
+    form a common subsequence.
+    """
+    total_lengths = lengths + len(ref_word)
+    lcs_lengths = lcs_lengths_np(ref_word, codes, lengths)
+    return np.where(
+        total_lengths > 0, 2.0 * lcs_lengths / np.maximum(total_lengths, 1), 1.0
+    )
+
+
+def indel_similarities_from_word_pairs(
+    word_pairs: Sequence[Tuple[str, str]],
+) -> List[float]:
+    """Computes indel_similarities_np for each pair, batching the pairs that share
+    their first word"""
+    pairs_idxs_per_ref_word: Dict[str, List[int]] = {}
+    for pair_idx, (ref_word, _) in enumerate(word_pairs):
+        pairs_idxs_per_ref_word.setdefault(ref_word, []).append(pair_idx)
+    similarities = [0.0] * len(word_pairs)
+    for ref_word, pairs_idxs in pairs_idxs_per_ref_word.items():
+        codes, lengths = encode_words(
+            [word_pairs[pair_idx][1] for pair_idx in pairs_idxs]
+        )
+        for pair_idx, similarity in zip(
+            pairs_idxs, indel_similarities_np(ref_word, codes, lengths)
+        ):
+            similarities[pair_idx] = float(similarity)
+    return similarities
+
+
+class IndelNpScorer:
+    """Computes the indel similarities, see indel_similarities_np, between one
+    referential word and all of its candidate sub sentences in a single batched NumPy
+    computation
+
+    This is not the levenshtein distance, only insertions and deletions are counted,
+    a substitution costing two edits.
+    """
+
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+
+    def score_pairs(
+        self,
+        ref_words: Sequence[str],
+        sub_sentences: Sequence[str],
+        candidates: Sequence[Sequence[int]],
+    ) -> List[Tuple[int, int, float]]:
+        """Same as DifflibScorer.score_pairs"""
+        sub_sentences_idxs_per_ref_word: Dict[int, List[int]] = {}
+        for sub_sentence_idx, ref_words_idxs in enumerate(candidates):
+            for ref_word_idx in ref_words_idxs:
+                sub_sentences_idxs_per_ref_word.setdefault(ref_word_idx, []).append(
+                    sub_sentence_idx
+                )
+        if not sub_sentences_idxs_per_ref_word:
+            return []
+        codes, lengths = encode_words(sub_sentences)
+        found = []
+        for ref_word_idx, sub_sentences_idxs in sub_sentences_idxs_per_ref_word.items():
+            rows = np.array(sub_sentences_idxs, dtype=np.int64)
+            rows_lengths = lengths[rows]
+            similarities = indel_similarities_np(
+                ref_words[ref_word_idx],
+                codes[rows, : rows_lengths.max(initial=0)],
+                rows_lengths,
+            )
+            for row_idx in np.nonzero(similarities >= self.threshold)[0]:
+                found.append(
+                    (ref_word_idx, int(rows[row_idx]), float(similarities[row_idx]))
+                )
+        return found
@@ -0,0 +1,93 @@
+import threading
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+import cachetools
+
+_MISSING = object()
+
+
+class SimilarityCacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+
+
+class SimilarityCache:
+    """A bounded least recently used cache of the scores of (standardized referential
+    word, sub sentence) pairs, shared by all the sentences a words matcher looks into
+
+    The pairs whose score does not reach the threshold are cached as well, as None,
+    so the cache is only valid for the scorer it has been filled with. It is emptied
+    when pickled, e.g for the worker processes, which fill their own.
+    """
+
+    def __init__(self, maxsize: int):
+        """
+        :param maxsize: The number of pairs kept
+        """
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._cache = cachetools.LRUCache(maxsize=maxsize)
+        self.hits = 0
+        self.misses = 0
+
+    def __getstate__(self):
+        return {"maxsize": self.maxsize}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def score_pairs(
+        self,
+        scorer,
+        ref_words: Sequence[str],
+        sub_sentences: Sequence[str],
+        candidates: Sequence[Sequence[int]],
+    ) -> List[Tuple[int, int, float]]:
+        """Same as scorer.score_pairs, only the pairs missing from the cache being
+        scored"""
+        found = []
+        missing_candidates = []
+        with self._lock:
+            for sub_sentence_idx, sub_sentence in enumerate(sub_sentences):
+                missing = []
+                for ref_word_idx in candidates[sub_sentence_idx]:
+                    score = self._cache.get(
+                        (ref_words[ref_word_idx], sub_sentence), _MISSING
+                    )
+                    if score is _MISSING:
+                        missing.append(ref_word_idx)
+                    elif score is not None:
+                        found.append((ref_word_idx, sub_sentence_idx, score))
+                self.misses += len(missing)
+                self.hits += len(candidates[sub_sentence_idx]) - len(missing)
+                missing_candidates.append(missing)
+
+        scored = scorer.score_pairs(ref_words, sub_sentences, missing_candidates)
+        scores = {
+            (ref_word_idx, sub_sentence_idx): score
+            for ref_word_idx, sub_sentence_idx, score in scored
+        }
+        with self._lock:
+            for sub_sentence_idx, missing in enumerate(missing_candidates):
+                for ref_word_idx in missing:
+                    self._cache[
+                        (ref_words[ref_word_idx], sub_sentences[sub_sentence_idx])
+                    ] = scores.get((ref_word_idx, sub_sentence_idx))
+        return found + scored
+
+    def info(self) -> SimilarityCacheInfo:
+        with self._lock:
+            return SimilarityCacheInfo(
+                hits=self.hits,
+                misses=self.misses,
+                maxsize=self.maxsize,
+                currsize=len(self._cache),
+            )
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
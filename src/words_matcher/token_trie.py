@@ -0,0 +1,114 @@
+import collections
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+# tolerance on the score upper bound so that rounding never prunes a reachable match
+_BOUND_TOLERANCE = 1e-9
+
+
+class TokenTrieNode:
+    __slots__ = ("children", "entries_idxs", "char_counts", "max_length")
+
+    def __init__(self):
+        self.children: Dict[str, "TokenTrieNode"] = {}
+        # the entries whose tokens are exactly the path from the root to this node
+        self.entries_idxs: List[int] = []
+        # the highest count of each character and the highest length among the
+        # entries of the subtree, used to bound the score of the entries below
+        self.char_counts: Dict[str, int] = {}
+        self.max_length = 0
+
+    def add_entry(self, word: str):
+        for char, count in collections.Counter(word).items():
+            if count > self.char_counts.get(char, 0):
+                self.char_counts[char] = count
+        self.max_length = max(self.max_length, len(word))
+
+    def may_reach(self, sub_sentence_char_counts: Dict[str, int], threshold: float):
+        """Tells whether some entry of the subtree may still reach threshold with a
+        sub sentence starting with the characters counted so far
+
+        The characters of the sub sentence that no entry of the subtree has, in that
+        quantity, are never matched and the sub sentence can only get longer: a
+        referential word of length l then scores at most 2 * l / (2 * l + unmatched).
+        """
+        unmatched = 0
+        for char, count in sub_sentence_char_counts.items():
+            unmatched += max(0, count - self.char_counts.get(char, 0))
+        if not unmatched:
+            return True
+        return (
+            2.0 * self.max_length / (2 * self.max_length + unmatched)
+            >= threshold - _BOUND_TOLERANCE
+        )
+
+
+class TokenTrie:
+    """A trie over the tokens of referential words made of several tokens
+
+    It is walked from each token of a sentence, extending the sub sentence one token
+    at a time only while some referential word below the reached nodes may still be
+    similar enough to it. N-grams that no multi tokens referential word can match are
+    thus never built. No referential word able to reach the threshold is left out.
+    """
+
+    def __init__(
+        self,
+        ref_words: Sequence[str],
+        ref_words_tokens: Sequence[Sequence[str]],
+        ref_words_idxs: Sequence[int],
+    ):
+        """
+        :param ref_words: The standardized referential words
+        :param ref_words_tokens: The tokens of each standardized referential word
+        :param ref_words_idxs: The positions in ref_words of the words to index
+        """
+        self.root = TokenTrieNode()
+        for ref_word_idx in ref_words_idxs:
+            ref_word = ref_words[ref_word_idx]
+            node = self.root
+            node.add_entry(ref_word)
+            for token in ref_words_tokens[ref_word_idx]:
+                node = node.children.setdefault(token, TokenTrieNode())
+                node.add_entry(ref_word)
+            node.entries_idxs.append(ref_word_idx)
+
+    def spans(
+        self, sentence_words: Sequence[str], threshold: float
+    ) -> Iterator[Tuple[int, int, str, List[int]]]:
+        """Yields the n-grams of the sentence that may match some referential word
+
+        :param sentence_words: The tokens of the standardized sentence
+        :param threshold: The similarity threshold
+        :returns: The (first token position, number of tokens, sub sentence, candidate
+            referential words positions) of each n-gram worth scoring
+        """
+        for first_token_idx in range(len(sentence_words)):
+            nodes = [self.root]
+            sub_sentence_char_counts = collections.Counter()
+            sub_sentence = None
+            for token_idx in range(first_token_idx, len(sentence_words)):
+                token = sentence_words[token_idx]
+                if sub_sentence is None:
+                    sub_sentence = token
+                else:
+                    sub_sentence = f"{sub_sentence} {token}"
+                    sub_sentence_char_counts[" "] += 1
+                sub_sentence_char_counts.update(token)
+                nodes = [
+                    child
+                    for node in nodes
+                    for child in node.children.values()
+                    if child.may_reach(sub_sentence_char_counts, threshold)
+                ]
+                if not nodes:
+                    break
+                candidates = [
+                    entry_idx for node in nodes for entry_idx in node.entries_idxs
+                ]
+                if candidates:
+                    yield (
+                        first_token_idx,
+                        token_idx - first_token_idx + 1,
+                        sub_sentence,
+                        sorted(candidates),
+                    )
@@ -0,0 +1,84 @@
+import collections
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from src.words_matcher.similarity import min_common_subsequence_length
+
+TRIGRAM_LENGTH = 3
+
+
+def trigrams(word: str) -> Dict[str, int]:
+    return collections.Counter(
+        word[i : i + TRIGRAM_LENGTH] for i in range(len(word) - TRIGRAM_LENGTH + 1)
+    )
+
+
+@lru_cache(maxsize=4096)
+def min_common_trigrams(
+    ref_word_length: int, word_length: int, threshold: float
+) -> Optional[int]:
+    """Returns how many trigrams two words of the given lengths must at least share
+    to possibly have a similarity above threshold, or None if they never can
+
+    Given a longest common subsequence of length lcs, each of the ref_word characters
+    left out breaks at most 3 of its trigrams and each of the word characters left out
+    breaks at most 2 of them, the other trigrams being found in word as well.
+    """
+    lcs_length = min_common_subsequence_length(ref_word_length, word_length, threshold)
+    if lcs_length is None:
+        return None
+    return (
+        (ref_word_length - TRIGRAM_LENGTH + 1)
+        - TRIGRAM_LENGTH * (ref_word_length - lcs_length)
+        - (TRIGRAM_LENGTH - 1) * (word_length - lcs_length)
+    )
+
+
+class TrigramIndex:
+    """An inverted index from character trigrams to referential words
+
+    It is used to keep, for a given sub sentence, only the referential words that share
+    enough trigrams with it to possibly reach the similarity threshold. No referential
+    word able to reach the threshold is left out.
+    """
+
+    def __init__(self, ref_words: Sequence[str], ref_words_idxs: Sequence[int]):
+        """
+        :param ref_words: The standardized referential words
+        :param ref_words_idxs: The positions in ref_words of the words to index
+        """
+        self.ref_words_lengths: Dict[int, int] = {}
+        self.ref_words_idxs_by_length: Dict[int, List[int]] = {}
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        for ref_word_idx in ref_words_idxs:
+            ref_word = ref_words[ref_word_idx]
+            self.ref_words_lengths[ref_word_idx] = len(ref_word)
+            self.ref_words_idxs_by_length.setdefault(len(ref_word), []).append(
+                ref_word_idx
+            )
+            for trigram, count in trigrams(ref_word).items():
+                self.postings.setdefault(trigram, []).append((ref_word_idx, count))
+
+    def candidates(self, word: str, threshold: float) -> List[int]:
+        """Returns the positions of the referential words that may reach threshold"""
+        candidates = []
+        # the number of common trigrams required from the ref words of each length
+        required_by_length = {}
+        for ref_word_length, ref_words_idxs in self.ref_words_idxs_by_length.items():
+            required = min_common_trigrams(ref_word_length, len(word), threshold)
+            if required is None:
+                continue
+            if required <= 0:
+                candidates += ref_words_idxs
+            else:
+                required_by_length[ref_word_length] = required
+        if required_by_length:
+            common_trigrams = collections.defaultdict(int)
+            for trigram, count in trigrams(word).items():
+                for ref_word_idx, ref_word_count in self.postings.get(trigram, ()):
+                    common_trigrams[ref_word_idx] += min(count, ref_word_count)
+            for ref_word_idx, count in common_trigrams.items():
+                required = required_by_length.get(self.ref_words_lengths[ref_word_idx])
+                if required is not None and count >= required:
+                    candidates.append(ref_word_idx)
+        return sorted(candidates)
@@ -1,63 +1,119 @@
 import difflib
-import itertools
 import logging
-import multiprocessing
 import os
-from functools import partial
-from typing import List, Sequence, Tuple, Union
+import threading
+from functools import lru_cache, partial
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
 
+import cachetools
 import numpy as np
 from nltk.tokenize import word_tokenize
 
 from src.config import Config
-from src.utils import chunks
-from src.words_matcher.match import Match, MatchFilter, OverlappingMatches
+from src.normalizer import ACCENTS_FOLDING_TABLE, NormalizedLabel
+from src.words_matcher.bk_tree import BKTree
+from src.words_matcher.match import Match, MatchBatch, MatchFilter
+from src.words_matcher.pool import worker_pool
+from src.words_matcher.referential import (
+    CandidateIndexType,
+    CompiledReferential,
+    ReferentialEntry,
+)
+from src.words_matcher.scripts import text_scripts
+from src.words_matcher.similarity import (
+    DifflibScorer,
+    IndelNpScorer,
+    SimilarityType,
+    encode_words,
+    indel_similarities_from_word_pairs,
+    indel_similarities_np,
+)
+from src.words_matcher.similarity_cache import SimilarityCache
+from src.words_matcher.trigram_index import TrigramIndex
 
 logger = logging.getLogger(__name__)
 
+# the referentials given as words are compiled once per distinct words, so that
+# giving the same words again reuses the same compiled referential
+MAX_COMPILED_REFERENTIALS = 4
 
-def filter_same_location_matches(
-    matches: List[Match], filter_on: str = MatchFilter.longest
-):
-    overlaps = []
-    for match in matches:
-        match_is_overlapping = False
-        for overlap in overlaps:
-            if overlap.match_overlaps(match):
-                match_is_overlapping = True
-                overlap.add(match)
-                break
-        if not match_is_overlapping:
-            overlaps.append(
-                OverlappingMatches(
-                    left_bound=match.start, right_bound=match.end, matches=[match]
-                )
-            )
-    if filter_on == MatchFilter.longest:
-        return [
-            sorted(
-                overlap.matches, key=lambda match: len(match.found_word), reverse=True
-            )[0]
-            for overlap in overlaps
-        ]
-    elif filter_on == MatchFilter.best:
-        return [
-            sorted(overlap.matches, key=lambda match: len(match.score), reverse=True)[0]
-            for overlap in overlaps
-        ]
-    else:
-        raise NotImplementedError
 
+class SubSentencesToScore:
+    """The distinct sub sentences of a sentence to score, each one being scored once
+    however many times it occurs, with the positions of the referential words to
+    compare it to and the position of the first token of each of its occurrences"""
+
+    def __init__(
+        self,
+        referential: CompiledReferential,
+        exact_occurrence_ends: List[List[int]],
+        entries_mask: Optional[np.ndarray] = None,
+    ):
+        """
+        :param exact_occurrence_ends: For each tag and token, the last token of the
+            exact occurrences of the tag the token is part of
+        :param entries_mask: The referential words to compare the sub sentences to,
+            all of them if None
+        """
+        self.referential = referential
+        self.exact_occurrence_ends = exact_occurrence_ends
+        self.entries_mask = entries_mask
+        self.sub_sentences: List[str] = []
+        self.candidates: List[Sequence[int]] = []
+        self.occurrences: List[List[int]] = []
+        self.sub_sentences_idxs_by_key: Dict[Tuple[str, int, Tuple[int, ...]], int] = {}
 
-def filter_best_matches(matches: List[Match]):
-    best_matches = {}
-    for match in matches:
-        if (
-            match.found_word not in best_matches
-            or match.score > best_matches[match.found_word].score
-        ):
-            best_matches[match.found_word] = match
-    return list(best_matches.values())
+    def covered_tags_ids(self, first_token_idx: int, n_tokens: int) -> Tuple[int, ...]:
+        """Returns the tags of the exact occurrences an n-gram lies within"""
+        last_token_idx = first_token_idx + n_tokens - 1
+        return tuple(
+            tag_id
+            for tag_id, tag_occurrence_ends in enumerate(self.exact_occurrence_ends)
+            if tag_occurrence_ends[first_token_idx] >= last_token_idx
+        )
+
+    def select_candidates(
+        self, entries_idxs: Sequence[int], covered_tags_ids: Tuple[int, ...]
+    ) -> Sequence[int]:
+        """Keeps the referential words of the mask whose tag does not cover the
+        sub sentence"""
+        if self.entries_mask is not None:
+            entries_idxs = [
+                entry_idx for entry_idx in entries_idxs if self.entries_mask[entry_idx]
+            ]
+        if covered_tags_ids:
+            entries_idxs = [
+                entry_idx
+                for entry_idx in entries_idxs
+                if self.referential.entries_tags_ids[entry_idx] not in covered_tags_ids
+            ]
+        return entries_idxs
+
+    def add(
+        self,
+        sub_sentence: str,
+        first_token_idx: int,
+        n_tokens: int,
+        get_entries_idxs: Callable[[], Sequence[int]],
+    ):
+        """Adds an occurrence of sub_sentence, get_entries_idxs giving the referential
+        words to compare it to the first time it is added"""
+        covered_tags_ids = self.covered_tags_ids(first_token_idx, n_tokens)
+        if covered_tags_ids and len(covered_tags_ids) == len(self.referential.tags):
+            return
+        # the candidates of a sub sentence only depend on it, its number of tokens and
+        # the tags it is covered by, they are only looked for once
+        key = (sub_sentence, n_tokens, covered_tags_ids)
+        sub_sentence_idx = self.sub_sentences_idxs_by_key.get(key)
+        if sub_sentence_idx is None:
+            sub_sentence_idx = len(self.sub_sentences)
+            self.sub_sentences_idxs_by_key[key] = sub_sentence_idx
+            self.sub_sentences.append(sub_sentence)
+            self.candidates.append(
+                self.select_candidates(get_entries_idxs(), covered_tags_ids)
+            )
+            self.occurrences.append([])
+        self.occurrences[sub_sentence_idx].append(first_token_idx)
 
 
 class WordsMatcher:
@@ -69,11 +125,30 @@ class WordsMatcher:
         tokenization_type: str = "split",
         extract_with_multi_process: bool = False,
         similarity_threshold: float = 0.72,
+        prune_similarity: bool = True,
+        candidate_index: Optional[str] = None,
+        exact_match_fast_path: bool = False,
+        multi_tokens_trie: bool = False,
+        similarity_cache_size: Optional[int] = None,
+        script_pruning: bool = False,
     ):
         """
-        :param similarity_type: The type of distance to use between strings (is one of "difflib")
+        :param similarity_type: The type of distance to use between strings (is one of "difflib", "indel_np",
+            the latter being the indel similarity 2 * lcs / (m + n) rather than a levenshtein ratio)
         :param extract_with_multi_process: This indicates whether to parallelize computations over sentences
-        :
+        :param prune_similarity: This indicates whether to skip the pairs whose similarity upper bounds
+            are below the similarity threshold, matches are the same either way
+        :param candidate_index: The index used to select, for each sub sentence, the referential words
+            that may be similar enough to it (is one of None, "trigram", "bk_tree"), matches are the same either way
+        :param exact_match_fast_path: This indicates whether to first look for the exact occurrences of the
+            referential words and to only look for similar words in the rest of the sentence
+        :param multi_tokens_trie: This indicates whether to look for the referential words made of several
+            tokens by walking a trie of their tokens, matches are the same either way
+        :param similarity_cache_size: The number of (referential word, sub sentence) scores to keep
+            across calls, None for no cache, matches are the same either way
+        :param script_pruning: This indicates whether to first only compare a sentence to the referential
+            words written in the scripts of its letters, e.g latin or cyrillic, the others being compared
+            to it for the tags none of whose words has been found
         """
         self.similarity_type: str = similarity_type
         self.extract_with_multi_process: bool = extract_with_multi_process
@@ -83,6 +158,35 @@ class WordsMatcher:
         self.tokenization_type = tokenization_type
         self.tokenization_func = self._get_tokenization_func()
         self.similarity_threshold = similarity_threshold
+        self.prune_similarity = prune_similarity
+        self.candidate_index = candidate_index
+        self.exact_match_fast_path = exact_match_fast_path
+        self.multi_tokens_trie = multi_tokens_trie
+        self.similarity_cache: Optional[SimilarityCache] = None
+        if similarity_cache_size is not None:
+            self.similarity_cache = SimilarityCache(maxsize=similarity_cache_size)
+        self.script_pruning = script_pruning
+        self._compiled_referentials_lock = threading.Lock()
+        self._compiled_referentials = cachetools.LRUCache(
+            maxsize=MAX_COMPILED_REFERENTIALS
+        )
+
+    def __getstate__(self):
+        # the tokenization function may be a lambda, it is rebuilt when unpickling
+        # e.g in the worker processes, which also compile their own referentials
+        state = self.__dict__.copy()
+        del state["tokenization_func"]
+        del state["_compiled_referentials_lock"]
+        del state["_compiled_referentials"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.tokenization_func = self._get_tokenization_func()
+        self._compiled_referentials_lock = threading.Lock()
+        self._compiled_referentials = cachetools.LRUCache(
+            maxsize=MAX_COMPILED_REFERENTIALS
+        )
 
     def _get_tokenization_func(self):
         if self.tokenization_type == "split":
@@ -94,8 +198,146 @@ class WordsMatcher:
     def tokenize(self, x: str):
         return self.tokenization_func(x)
 
+    def tokenize_with_spans(self, x: str) -> Tuple[List[str], List[Tuple[int, int]]]:
+        """Returns the tokens of x along with their (start, end) position, end excluded"""
+        tokens = self.tokenize(x)
+        return tokens, self.tokens_spans(x, tokens)
+
+    @staticmethod
+    def tokens_spans(x: str, tokens: Sequence[str]) -> List[Tuple[int, int]]:
+        """Returns the (start, end) position in x of each of its tokens, end excluded"""
+        spans = []
+        position = 0
+        for token in tokens:
+            start = x.find(token, position)
+            if start < 0:
+                # the tokenization has altered the token, e.g quotes by word_tokenize
+                start = position
+            spans.append((start, start + len(token)))
+            position = start + len(token)
+        return spans
+
+    def get_scorer(self) -> Union[DifflibScorer, IndelNpScorer]:
+        if self.similarity_type == SimilarityType.difflib:
+            return DifflibScorer(
+                threshold=self.similarity_threshold, prune=self.prune_similarity
+            )
+        if self.similarity_type == SimilarityType.indel_np:
+            return IndelNpScorer(threshold=self.similarity_threshold)
+        raise NotImplementedError
+
+    def compile_referential(
+        self, referential: Sequence[str], tags: Optional[Sequence[str]] = None
+    ) -> CompiledReferential:
+        """Standardizes and tokenizes the referential words once so that they can be
+        looked for in any number of sentences without being prepared again
+
+        :param referential: The group of words that are looked for in sentences
+        :param tags: The group each referential word belongs to, when several groups
+            of words are looked for in a single pass, an exact occurrence of a word
+            only keeping the words of its own group from being looked for around it
+        :returns: The compiled referential to give to find_words_in_sentences
+        """
+        if tags is None:
+            tags = [None] * len(referential)
+        entries = []
+        for referential_word, tag in zip(referential, tags):
+            standard_ref_word = self.standardize_word(referential_word)
+            if standard_ref_word not in self.referential_words_as_tokens:
+                self.referential_words_as_tokens[standard_ref_word] = self.tokenize(
+                    standard_ref_word
+                )
+            entries.append(
+                ReferentialEntry(
+                    word=referential_word,
+                    standardized=standard_ref_word,
+                    tokens=tuple(self.referential_words_as_tokens[standard_ref_word]),
+                    tag=tag,
+                )
+            )
+        return CompiledReferential(
+            entries=entries, tokenization_type=self.tokenization_type
+        )
+
+    def get_candidate_index(
+        self, referential: CompiledReferential, n_tokens: int
+    ) -> Optional[Union[TrigramIndex, BKTree]]:
+        if self.candidate_index is None:
+            return None
+        key = (self.candidate_index, n_tokens)
+        if key not in referential.candidate_indexes:
+            if self.candidate_index == CandidateIndexType.trigram:
+                index_class = TrigramIndex
+            elif self.candidate_index == CandidateIndexType.bk_tree:
+                index_class = BKTree
+            else:
+                raise NotImplementedError
+            referential.candidate_indexes[key] = index_class(
+                ref_words=referential.standardized_words,
+                ref_words_idxs=referential.entries_idxs_by_n_tokens.get(n_tokens, []),
+            )
+        return referential.candidate_indexes[key]
+
+    def find_exact_words(
+        self,
+        sentence: str,
+        sentence_words: Sequence[str],
+        referential: CompiledReferential,
+        sentence_spans: Optional[Sequence[Tuple[int, int]]] = None,
+    ) -> List[Tuple[int, int, str]]:
+        """Finds in a single pass the sub sentences that are exactly referential words
+
+        :param sentence: The standardized sentence
+        :param sentence_words: The tokens of the standardized sentence
+        :param referential: The compiled group of words that are looked for in sentence
+        :param sentence_spans: The positions of the tokens in sentence, if already known
+        :returns: The (entry position, position of first token, sub sentence) of each
+            exact occurrence of a referential word made of whole tokens
+        """
+        spans = sentence_spans
+        if spans is None:
+            spans = self.tokens_spans(sentence, sentence_words)
+        token_idx_by_start = {
+            start: token_idx for token_idx, (start, _) in enumerate(spans)
+        }
+        token_idx_by_end = {end: token_idx for token_idx, (_, end) in enumerate(spans)}
+        found = []
+        for start, end, entry_idx in referential.exact_matcher.find_all(sentence):
+            first_token_idx = token_idx_by_start.get(start)
+            last_token_idx = token_idx_by_end.get(end)
+            if first_token_idx is None or last_token_idx is None:
+                continue
+            sub_sentence = " ".join(
+                sentence_words[first_token_idx : last_token_idx + 1]
+            )
+            if sub_sentence == referential[entry_idx].standardized:
+                found.append((entry_idx, first_token_idx, sub_sentence))
+        return found
+
+    def _as_compiled_referential(
+        self, referential: Union[Sequence[str], CompiledReferential]
+    ) -> CompiledReferential:
+        if not isinstance(referential, CompiledReferential):
+            # the same words give the same compiled referential, which the worker
+            # pool, keeping the referentials it has been started with, recognizes
+            words = tuple(referential)
+            with self._compiled_referentials_lock:
+                compiled_referential = self._compiled_referentials.get(words)
+                if compiled_referential is None:
+                    compiled_referential = self.compile_referential(words)
+                    self._compiled_referentials[words] = compiled_referential
+            return compiled_referential
+        if referential.tokenization_type != self.tokenization_type:
+            raise ValueError(
+                f"Referential has been compiled with {referential.tokenization_type} "
+                f"tokenization but words matcher uses {self.tokenization_type}"
+            )
+        return referential
+
     def top_similar_referential_word_per_sentence(
-        self, sentences: Sequence[str], referential: Sequence[str],
+        self,
+        sentences: Sequence[Union[str, NormalizedLabel]],
+        referential: Union[Sequence[str], CompiledReferential],
     ) -> List[Union[str, None]]:
         (
             similar_referential_words_per_sentence,
@@ -112,48 +354,67 @@ class WordsMatcher:
 
     def find_words_in_sentences(
         self,
-        sentences: Sequence[str],
-        referential: Sequence[str],
+        sentences: Sequence[Union[str, NormalizedLabel]],
+        referential: Union[Sequence[str], CompiledReferential],
         keep_best_same_match: bool = True,
         filter_same_location_match: bool = True,
         filter_same_location_match_on: str = MatchFilter.longest,
     ) -> Tuple[List[List[str]], List[List[float]]]:
-        if not self.extract_with_multi_process:
-            return self._find_words_in_sentences(
-                sentences,
+        referential = self._as_compiled_referential(referential)
+        if self.extract_with_multi_process:
+            logger.info(
+                f"Extraction of similar referential words has been required"
+                f" with multiprocessing "
+                f"number of available threads for multiprocess: {worker_pool.processes}"
+            )
+            # None when there are too few sentences to be worth parallelizing
+            matches_per_sentence = worker_pool.find_words_in_sentences(
                 self,
                 referential,
+                sentences,
                 keep_best_same_match=keep_best_same_match,
                 filter_same_location_match=filter_same_location_match,
                 filter_same_location_match_on=filter_same_location_match_on,
             )
-        processes = multiprocessing.cpu_count()
-        logger.info(
-            f"Extraction of similar referential words has been required"
-            f" with multiprocessing "
-            f"number of available threads for multiprocess: {processes}"
+            if matches_per_sentence is not None:
+                return matches_per_sentence
+        return self._find_words_in_sentences(
+            sentences,
+            self,
+            referential,
+            keep_best_same_match=keep_best_same_match,
+            filter_same_location_match=filter_same_location_match,
+            filter_same_location_match_on=filter_same_location_match_on,
         )
-        pool = multiprocessing.Pool(processes=processes)
-        matches_per_sentence = pool.map(
-            partial(
-                self._find_words_in_sentences,
-                words_matcher=self,
-                referential=referential,
+
+    def find_match_batches(
+        self,
+        sentences: Sequence[Union[str, NormalizedLabel]],
+        referential: Union[Sequence[str], CompiledReferential],
+        keep_best_same_match: bool = True,
+        filter_same_location_match: bool = True,
+        filter_same_location_match_on: str = MatchFilter.longest,
+    ) -> List[MatchBatch]:
+        """Same as find_words_in_sentences, the matches of each sentence being returned
+        as a MatchBatch, from which Match objects can be built with to_matches"""
+        referential = self._as_compiled_referential(referential)
+        return [
+            self._find_match_batch(
+                self,
+                sentence,
+                referential,
                 keep_best_same_match=keep_best_same_match,
                 filter_same_location_match=filter_same_location_match,
                 filter_same_location_match_on=filter_same_location_match_on,
-            ),
-            chunks(elems=sentences, chunk_size=len(sentences) // processes),
-        )
-        pool.close()
-        pool.join()
-        return list(itertools.chain(*matches_per_sentence))
+            )
+            for sentence in sentences
+        ]
 
     @staticmethod
     def _find_words_in_sentences(
-        sentences: Sequence[str],
+        sentences: Sequence[Union[str, NormalizedLabel]],
         words_matcher: "WordsMatcher",
-        referential: Sequence[str],
+        referential: CompiledReferential,
         keep_best_same_match: bool = True,
         filter_same_location_match: bool = True,
         filter_same_location_match_on: str = MatchFilter.longest,
@@ -177,68 +438,298 @@ class WordsMatcher:
     @staticmethod
     def _find_words_in_sentence(
         words_matcher: "WordsMatcher",
-        sentence: str,
-        referential: Sequence[str],
+        sentence: Union[str, NormalizedLabel],
+        referential: CompiledReferential,
         keep_best_same_match: bool = True,
         filter_same_location_match: bool = True,
         filter_same_location_match_on: str = MatchFilter.longest,
     ) -> List[Match]:
+        return WordsMatcher._find_match_batch(
+            words_matcher,
+            sentence,
+            referential,
+            keep_best_same_match=keep_best_same_match,
+            filter_same_location_match=filter_same_location_match,
+            filter_same_location_match_on=filter_same_location_match_on,
+        ).to_matches()
+
+    @staticmethod
+    def _find_match_batch(
+        words_matcher: "WordsMatcher",
+        sentence: Union[str, NormalizedLabel],
+        referential: CompiledReferential,
+        keep_best_same_match: bool = True,
+        filter_same_location_match: bool = True,
+        filter_same_location_match_on: str = MatchFilter.longest,
+    ) -> MatchBatch:
         """Finds the referential words that are found in sentence with a similarity above some threshold parameter
 
         :param words_matcher: An instance of the WordsMatcher class
-        :param sentence: The sentence in which to look for similar referential words
-        :param referential: The group of words that are looked for in sentence
-        :returns: A list of referential words found in sentence
-        :returns: The list of the similarities scores of the referential words found in sentence
+        :param sentence: The sentence in which to look for similar referential words, a
+            NormalizedLabel being used as it is instead of being standardized again
+        :param referential: The compiled group of words that are looked for in sentence
+        :returns: The referential words found in sentence, with their position and
+            similarity score
         """
-        standardized_sentence = words_matcher.standardize_word(sentence)
-        sentence_words = words_matcher.tokenize(standardized_sentence)
-        referential_words = []
-        # standard_ref_words words might have been modified compared to ref_words words
-        # e.g Make-Up standardized to make up
-        standardized_referential_words = []
-        sub_sentences = []
-        for referential_word in referential:
-            standard_ref_word = words_matcher.standardize_word(referential_word)
-            if standard_ref_word not in words_matcher.referential_words_as_tokens:
-                words_matcher.referential_words_as_tokens[
-                    standard_ref_word
-                ] = words_matcher.tokenize(standard_ref_word)
-            n_words_grams = words_matcher.n_grams_from_sentence_words(
+        if isinstance(sentence, NormalizedLabel):
+            # already standardized once for all the passes over the label
+            standardized_sentence = sentence.text
+        else:
+            standardized_sentence = words_matcher.standardize_word(sentence)
+        sentence_words, sentence_spans = words_matcher.tokenize_with_spans(
+            standardized_sentence
+        )
+        exact_found, exact_occurrence_ends = WordsMatcher._find_exact_occurrences(
+            words_matcher,
+            standardized_sentence,
+            sentence_words,
+            sentence_spans,
+            referential,
+        )
+        entries_mask = None
+        if words_matcher.script_pruning:
+            entries_mask = referential.scripts_mask(text_scripts(standardized_sentence))
+        sub_sentences, occurrences, scored = WordsMatcher._score_sub_sentences(
+            words_matcher,
+            sentence_words,
+            referential,
+            exact_occurrence_ends,
+            entries_mask,
+        )
+        if entries_mask is not None and not entries_mask.all():
+            widened = WordsMatcher._score_other_scripts(
+                words_matcher,
                 sentence_words,
-                n_grams=len(
-                    words_matcher.referential_words_as_tokens[standard_ref_word]
-                ),
+                referential,
+                exact_occurrence_ends,
+                entries_mask,
+                found_entries_idxs=[
+                    entry_idx for entry_idx, *_ in [*exact_found, *scored]
+                ],
             )
-            sub_sentences += [" ".join(n_words_gram) for n_words_gram in n_words_grams]
-            standardized_referential_words += [standard_ref_word] * len(n_words_grams)
-            referential_words += [referential_word] * len(n_words_grams)
-
-        similarities_scores = words_matcher.similarities_from_word_pairs(
-            list(zip(standardized_referential_words, sub_sentences)),
-            words_matcher.similarity_type,
-            multi_process=False,
+            scored += [
+                (entry_idx, len(sub_sentences) + sub_sentence_idx, score)
+                for entry_idx, sub_sentence_idx, score in widened[2]
+            ]
+            sub_sentences += widened[0]
+            occurrences += widened[1]
+        matches = WordsMatcher._build_match_batch(
+            standardized_sentence,
+            sentence_spans,
+            referential,
+            exact_found,
+            sub_sentences,
+            occurrences,
+            scored,
         )
-        similar_ref_words_idxs = np.where(
-            np.array(similarities_scores) >= words_matcher.similarity_threshold
-        )[0]
-        matches = [
-            Match(
-                found_word=referential_words[idx],
-                matching_sub_sentence=sub_sentences[idx],
-                score=similarities_scores[idx],
-                sentence=standardized_sentence,
-            )
-            for idx in similar_ref_words_idxs
-        ]
         if keep_best_same_match:
-            matches = filter_best_matches(matches)
+            matches = matches.best_per_word()
         if filter_same_location_match:
-            matches = filter_same_location_matches(
-                matches, filter_on=filter_same_location_match_on
-            )
+            matches = matches.without_overlaps(filter_on=filter_same_location_match_on)
         return matches
 
+    @staticmethod
+    def _find_exact_occurrences(
+        words_matcher: "WordsMatcher",
+        standardized_sentence: str,
+        sentence_words: Sequence[str],
+        sentence_spans: Sequence[Tuple[int, int]],
+        referential: CompiledReferential,
+    ) -> Tuple[List[Tuple[int, int, str, float]], List[List[int]]]:
+        """Finds the exact occurrences of the referential words in a sentence, when
+        the exact match fast path is on
+
+        :returns: The (entry position, first token position, sub sentence, score) of
+            each exact occurrence and, for each tag and token, the last token of the
+            exact occurrences of the tag the token is part of
+        """
+        exact_found = []
+        # the n-grams lying within an exact occurrence of a referential word are not
+        # looked at again for similar words of the same tag, for each tag and token
+        # this is the last token of the exact occurrences it is part of
+        exact_occurrence_ends = [[-1] * len(sentence_words) for _ in referential.tags]
+        if not words_matcher.exact_match_fast_path:
+            return exact_found, exact_occurrence_ends
+        exact_words = words_matcher.find_exact_words(
+            standardized_sentence, sentence_words, referential, sentence_spans
+        )
+        for entry_idx, first_token_idx, sub_sentence in exact_words:
+            exact_found.append(
+                (
+                    entry_idx,
+                    first_token_idx,
+                    sub_sentence,
+                    words_matcher.similarity(
+                        sub_sentence, sub_sentence, words_matcher.similarity_type
+                    ),
+                )
+            )
+            last_token_idx = first_token_idx + referential[entry_idx].n_tokens - 1
+            tag_occurrence_ends = exact_occurrence_ends[
+                referential.entries_tags_ids[entry_idx]
+            ]
+            for token_idx in range(first_token_idx, last_token_idx + 1):
+                tag_occurrence_ends[token_idx] = max(
+                    tag_occurrence_ends[token_idx], last_token_idx
+                )
+        return exact_found, exact_occurrence_ends
+
+    @staticmethod
+    def _score_other_scripts(
+        words_matcher: "WordsMatcher",
+        sentence_words: Sequence[str],
+        referential: CompiledReferential,
+        exact_occurrence_ends: List[List[int]],
+        entries_mask: np.ndarray,
+        found_entries_idxs: Sequence[int],
+    ) -> Tuple[List[str], List[List[int]], List[Tuple[int, int, float]]]:
+        """Scores the n-grams of a sentence against the spellings written in other
+        scripts than the sentence, which are only looked for when nothing of their tag
+        has been found, see _score_sub_sentences
+
+        :param entries_mask: The spellings written in the scripts of the sentence
+        :param found_entries_idxs: The positions of the referential words found so far
+        """
+        found_tags_ids = {
+            referential.entries_tags_ids[entry_idx] for entry_idx in found_entries_idxs
+        }
+        widened_mask = ~entries_mask & np.array(
+            [tag_id not in found_tags_ids for tag_id in referential.entries_tags_ids],
+            dtype=bool,
+        )
+        if not widened_mask.any():
+            return [], [], []
+        return WordsMatcher._score_sub_sentences(
+            words_matcher,
+            sentence_words,
+            referential,
+            exact_occurrence_ends,
+            widened_mask,
+        )
+
+    @staticmethod
+    def _build_match_batch(
+        standardized_sentence: str,
+        sentence_spans: Sequence[Tuple[int, int]],
+        referential: CompiledReferential,
+        exact_found: List[Tuple[int, int, str, float]],
+        sub_sentences: List[str],
+        occurrences: List[List[int]],
+        scored: List[Tuple[int, int, float]],
+    ) -> MatchBatch:
+        """Gathers the exact occurrences and the scored sub sentences of a sentence
+        into a MatchBatch"""
+        # the exact occurrences, which are not scored again, come after the scored
+        # sub sentences, as (entry position, sub sentence position, first token
+        # position, score), each score being given to all the occurrences
+        found = []
+        for entry_idx, first_token_idx, sub_sentence, score in exact_found:
+            found.append((entry_idx, len(sub_sentences), first_token_idx, score))
+            sub_sentences.append(sub_sentence)
+        for entry_idx, sub_sentence_idx, score in scored:
+            for first_token_idx in occurrences[sub_sentence_idx]:
+                found.append((entry_idx, sub_sentence_idx, first_token_idx, score))
+        entries_idxs = np.array([elem[0] for elem in found], dtype=np.int64)
+        sub_sentences_idxs = np.array([elem[1] for elem in found], dtype=np.int64)
+        first_tokens = np.array([elem[2] for elem in found], dtype=np.int64)
+        scores = np.array([elem[3] for elem in found], dtype=np.float64)
+        # keep matches ordered as the referential and then as the sentence
+        order = np.lexsort((first_tokens, entries_idxs))
+        entries_idxs = entries_idxs[order]
+        sub_sentences_idxs = sub_sentences_idxs[order]
+        scores = scores[order]
+        first_tokens = first_tokens[order]
+        spans = np.array(sentence_spans, dtype=np.int64).reshape(-1, 2)
+        last_tokens = first_tokens + referential.entries_n_tokens[entries_idxs] - 1
+        return MatchBatch(
+            sentence=standardized_sentence,
+            referential=referential,
+            sub_sentences=sub_sentences,
+            entries_idxs=entries_idxs,
+            sub_sentences_idxs=sub_sentences_idxs,
+            starts=spans[first_tokens, 0],
+            ends=spans[last_tokens, 1] - 1,
+            scores=scores,
+        )
+
+    @staticmethod
+    def _score_sub_sentences(
+        words_matcher: "WordsMatcher",
+        sentence_words: Sequence[str],
+        referential: CompiledReferential,
+        exact_occurrence_ends: List[List[int]],
+        entries_mask: Optional[np.ndarray] = None,
+    ) -> Tuple[List[str], List[List[int]], List[Tuple[int, int, float]]]:
+        """Scores the n-grams of a sentence against the referential words that may be
+        similar enough to them
+
+        :param sentence_words: The tokens of the standardized sentence
+        :param exact_occurrence_ends: For each tag and token, the last token of the
+            exact occurrences of the tag the token is part of
+        :param entries_mask: The referential words to compare the n-grams to, all of
+            them if None
+        :returns: The distinct sub sentences, the position of the first token of each
+            of their occurrences and the (entry position, sub sentence position,
+            score) of the pairs above the similarity threshold
+        """
+        scorer = words_matcher.get_scorer()
+        to_score = SubSentencesToScore(referential, exact_occurrence_ends, entries_mask)
+        token_trie = referential.token_trie if words_matcher.multi_tokens_trie else None
+        # the n-grams of a given length are built once and shared by all the
+        # referential words made of that number of tokens
+        for n_tokens, entries_idxs in referential.entries_idxs_by_n_tokens.items():
+            if token_trie is not None and n_tokens > 1:
+                continue
+            if entries_mask is not None:
+                entries_idxs = [
+                    entry_idx for entry_idx in entries_idxs if entries_mask[entry_idx]
+                ]
+                if not entries_idxs:
+                    continue
+            candidate_index = words_matcher.get_candidate_index(referential, n_tokens)
+            for first_token_idx, n_words_gram in enumerate(
+                words_matcher.n_grams_from_sentence_words(
+                    sentence_words, n_grams=n_tokens
+                )
+            ):
+                sub_sentence = " ".join(n_words_gram)
+                if candidate_index is None:
+                    get_entries_idxs = partial(list, entries_idxs)
+                else:
+                    get_entries_idxs = partial(
+                        candidate_index.candidates,
+                        sub_sentence,
+                        words_matcher.similarity_threshold,
+                    )
+                to_score.add(sub_sentence, first_token_idx, n_tokens, get_entries_idxs)
+        # the n-grams of the referential words made of several tokens are only built
+        # as long as some of these words may still match them
+        if token_trie is not None:
+            trie_spans = token_trie.spans(
+                sentence_words, words_matcher.similarity_threshold
+            )
+            for first_token_idx, n_tokens, sub_sentence, entries_idxs in trie_spans:
+                to_score.add(
+                    sub_sentence, first_token_idx, n_tokens, partial(list, entries_idxs)
+                )
+
+        # standardized words might have been modified compared to words
+        # e.g Make-Up standardized to make up
+        if words_matcher.similarity_cache is not None:
+            scored = words_matcher.similarity_cache.score_pairs(
+                scorer,
+                referential.standardized_words,
+                to_score.sub_sentences,
+                to_score.candidates,
+            )
+        else:
+            scored = scorer.score_pairs(
+                referential.standardized_words,
+                to_score.sub_sentences,
+                to_score.candidates,
+            )
+        return to_score.sub_sentences, to_score.occurrences, scored
+
     @staticmethod
     def standardize_word(word: str) -> str:
         word = str(word)
@@ -248,8 +739,7 @@ class WordsMatcher:
         word = word.replace(os.linesep, " ")
         word = word.lstrip()
         word = word.rstrip()
-        word = word.replace("é", "e")
-        word = word.replace("è", "e")
+        word = word.translate(ACCENTS_FOLDING_TABLE)
         return word.lower()
 
     @staticmethod
@@ -265,6 +755,8 @@ class WordsMatcher:
     def _similarities_from_word_pairs(
         word_pairs: List[Tuple[str, str]], similarity_type: str
     ) -> List[float]:
+        if similarity_type == SimilarityType.indel_np:
+            return indel_similarities_from_word_pairs(word_pairs)
         similarities_scores = [
             WordsMatcher.similarity(word1, word2, similarity_type)
             for word1, word2 in word_pairs
@@ -281,24 +773,25 @@ class WordsMatcher:
             return WordsMatcher._similarities_from_word_pairs(
                 word_pairs, similarity_type
             )
-        processes = multiprocessing.cpu_count()
-        pool = multiprocessing.Pool(processes=processes)
-        similarities = pool.map(
+        similarities = worker_pool.map_pairs(
             partial(
                 WordsMatcher._similarities_from_word_pairs,
                 similarity_type=similarity_type,
             ),
-            chunks(elems=word_pairs, chunk_size=len(word_pairs) // processes),
+            word_pairs,
         )
-        pool.close()
-        pool.join()
-        similarities = list(itertools.chain(*similarities))
+        if similarities is None:
+            similarities = WordsMatcher._similarities_from_word_pairs(
+                word_pairs, similarity_type
+            )
         return similarities
 
     @staticmethod
     def similarity(ref_word: str, word: str, similarity_type: str) -> float:
-        if similarity_type == "difflib":
+        if similarity_type == SimilarityType.difflib:
             return difflib.SequenceMatcher(None, ref_word, word).ratio()
+        elif similarity_type == SimilarityType.indel_np:
+            return float(indel_similarities_np(ref_word, *encode_words([word]))[0])
         else:
             raise NotImplementedError
 
@@ -325,11 +818,17 @@ class WordsMatcher:
         return top_word, top_similarity
 
 
-# @lru_cache
+@lru_cache()
 def get_words_matcher():
     return WordsMatcher(
         similarity_type=Config.WordsMatcher.similarity_type,
         tokenization_type=Config.WordsMatcher.tokenization_type,
         extract_with_multi_process=Config.WordsMatcher.extract_with_multi_process,
         similarity_threshold=Config.WordsMatcher.similarity_threshold,
+        prune_similarity=Config.WordsMatcher.prune_similarity,
+        candidate_index=Config.WordsMatcher.candidate_index,
+        exact_match_fast_path=Config.WordsMatcher.exact_match_fast_path,
+        multi_tokens_trie=Config.WordsMatcher.multi_tokens_trie,
+        similarity_cache_size=Config.WordsMatcher.similarity_cache_size,
+        script_pruning=Config.WordsMatcher.script_pruning,
     )
@@ -2,7 +2,8 @@ from typing import List
 
 import pytest
 
-from src.interpreter import Interpreter
+from src.interpreter import Interpreter, get_interpreter
+from src.words_matcher.words_matcher import get_words_matcher
 from tests.conftest import COUNTRIES, LABELS, MATERIALS_NAMES
 
 
@@ -34,3 +35,99 @@ def test_interpreter_find_country(
         assert Interpreter._standardize_country_name(country) in [
             Interpreter._standardize_country_name(name) for name in found_country.names
         ]
+
+
+def test_get_interpreter_is_shared_across_requests():
+    words_matcher = get_words_matcher()
+    assert get_interpreter(words_matcher=words_matcher) is get_interpreter(
+        words_matcher=words_matcher
+    )
+
+
+@pytest.mark.parametrize(
+    "label, expected_percentages",
+    [
+        (
+            "56% polyester\n41% laine\n3% elasthanne\nTissu 50% polyester",
+            {"polyester": 56.0, "laine": 41.0, "elasthanne": 3.0},
+        ),
+        ("polyester 80 %, elasthanne 20 %", {"polyester": 80.0, "elasthanne": 20.0}),
+    ],
+)
+def test_interpreter_find_materials_percentages(
+    interpreter: Interpreter, label: str, expected_percentages: dict
+):
+    materials = interpreter.find_materials(label)
+    assert len(materials) == len(expected_percentages)
+    for material in materials:
+        names = [
+            Interpreter._standardize_material_name(name) for name in material.names
+        ]
+        assert [
+            percentage
+            for material_name, percentage in expected_percentages.items()
+            if material_name in names
+        ] == [material.percentage]
+
+
+def test_interpret_finds_materials_and_country(interpreter: Interpreter):
+    for label in LABELS:
+        materials, country = interpreter.interpret(label)
+        assert materials == interpreter.find_materials(label)
+        assert country == interpreter.find_country(label)
+
+
+@pytest.mark.parametrize(
+    "label",
+    [
+        "Designed in Italy\n100% cotton\nMade in China",
+        # the country after 'made in' also occurs before it
+        "Designed in France\nfabric from China\nMade in China",
+    ],
+)
+def test_interpreter_find_country_prefers_made_in(interpreter: Interpreter, label: str):
+    country = interpreter.find_country(label)
+    assert "china" in [
+        Interpreter._standardize_country_name(name) for name in country.names
+    ]
+
+
+@pytest.mark.parametrize(
+    "label, materials_percentages, country_name",
+    [
+        ("60% cotton 40% wool\nMade in China", {"cotton": 60, "wool": 40}, "china"),
+        # 'lanka' looks like 'lana' but is far from any percentage
+        (
+            "100% cotton\nwash at 30 degrees, do not tumble dry, iron on low heat, do"
+            " not bleach\nMade in Sri Lanka",
+            {"cotton": 100},
+            "sri lanka",
+        ),
+        # the country before 'made in' is not looked for
+        ("Designed in Italy\n100% wool\nMade in China", {"wool": 100}, "china"),
+    ],
+)
+def test_interpreter_anchor_guided_search(
+    interpreter: Interpreter,
+    label: str,
+    materials_percentages: dict,
+    country_name: str,
+):
+    material, country = interpreter.materials[0], interpreter.countries[0]
+    guided_interpreter = Interpreter(
+        materials=[
+            material.copy(update={"names": ["cotton"]}),
+            material.copy(update={"names": ["wool", "lana"]}),
+        ],
+        countries=[
+            country.copy(update={"names": [name]})
+            for name in ["china", "italy", "sri lanka"]
+        ],
+        words_matcher=interpreter.words_matcher,
+        anchor_guided_search=True,
+    )
+    materials, country = guided_interpreter.interpret(label)
+    assert {
+        material.names[0]: material.percentage for material in materials
+    } == materials_percentages
+    assert country.names == [country_name]
@@ -0,0 +1,21 @@
+from src.normalizer import normalize_label
+
+
+def test_normalize_label():
+    label = "100%Coton (Bio)\nMADE IN Pérou"
+    normalized = normalize_label(label)
+    assert normalized.text == "100 % coton bio made in perou"
+    assert len(normalized.offsets) == len(normalized.text)
+    start = normalized.text.index("perou")
+    assert label[slice(*normalized.to_raw_span(start, start + len("perou")))] == "Pérou"
+    start = normalized.text.index("bio")
+    assert label[slice(*normalized.to_raw_span(start, start + len("bio")))] == "Bio"
+    assert normalize_label(label) is normalized
+
+
+def test_normalize_label_finds_origin_anchors():
+    normalized = normalize_label("Fabriqué en Chine / MADE INCHINA")
+    assert [
+        normalized.text[anchor_end:].split(" ")[0]
+        for anchor_end in normalized.origin_anchors_ends
+    ] == ["chine", "china"]
@@ -1,8 +1,54 @@
+import io
+import time
+from unittest import mock
+
 import pytest
 import requests
+from google.cloud import vision
+from PIL import Image
 
+import src.ocr as ocr_module
 from src.config import Config
-from src.ocr import get_ocr
+from src.exceptions import TextNotFound
+from src.ocr import (
+    MAX_IMAGES_PER_VISION_REQUEST,
+    GoogleImageFormat,
+    Ocr,
+    OcrBoundingPoly,
+    PreprocessedImage,
+    PreprocessedImagesCache,
+    get_ocr,
+)
+
+
+def encoded_image(size, color, image_format: str = "PNG") -> bytes:
+    image_bytes = io.BytesIO()
+    Image.new("RGB", size, color).save(image_bytes, format=image_format)
+    return image_bytes.getvalue()
+
+
+def image_red(content: bytes) -> int:
+    return Image.open(io.BytesIO(content)).convert("RGB").getpixel((0, 0))[0]
+
+
+def text_annotations(description: str, size):
+    """The text annotations of Google Vision for an image of the given size, with a
+    single word covering it"""
+    width, height = size
+    return [
+        vision.EntityAnnotation(description=description),
+        vision.EntityAnnotation(
+            description=description,
+            bounding_poly=vision.BoundingPoly(
+                vertices=[
+                    vision.Vertex(x=0, y=0),
+                    vision.Vertex(x=width, y=0),
+                    vision.Vertex(x=width, y=height),
+                    vision.Vertex(x=0, y=height),
+                ]
+            ),
+        ),
+    ]
 
 
 @pytest.mark.parametrize(
@@ -14,3 +60,143 @@ def test_ocr_set_image_format_for_google_ocr(image_url: str):
         image=ocr.get_image_from_bytes(image_bytes=requests.get(image_url).content)
     )
     assert image.format == Config.Ocr.google_image_format
+
+
+def test_vision_client_is_created_on_first_use_and_shared(monkeypatch):
+    client_class = mock.MagicMock()
+    monkeypatch.setattr(ocr_module.vision, "ImageAnnotatorClient", client_class)
+    monkeypatch.setattr(ocr_module, "_vision_client", None)
+    get_ocr.cache_clear()
+    ocr = get_ocr()
+    assert ocr is get_ocr()
+    # no image, no call to Google Vision
+    assert ocr.batch([]) == []
+    client_class.assert_not_called()
+    assert Ocr().client_vision is ocr.client_vision
+    client_class.assert_called_once()
+
+
+def test_preprocessed_images_cache_evicts_by_size():
+    cache = PreprocessedImagesCache(max_bytes=10)
+    keys = [cache.key(image_bytes, None) for image_bytes in [b"a", b"b", b"c"]]
+    for key in keys:
+        cache.set(
+            key, PreprocessedImage(content=b"12345", size=(1, 1), original_size=(1, 1))
+        )
+    assert cache.get(keys[0]) is None
+    assert cache.get(keys[2]) is not None
+    info = cache.info()
+    assert (info.hits, info.misses, info.evictions, info.currsize) == (1, 1, 1, 10)
+
+
+def test_batch_sends_the_images_to_vision_in_chunks(monkeypatch):
+    # told apart by their color, which png keeps as it is, and by their size
+    images_bytes = [
+        encoded_image((40 + image_idx, 30), (image_idx, 0, 0))
+        for image_idx in range(MAX_IMAGES_PER_VISION_REQUEST + 1)
+    ]
+
+    def batch_annotate_images(requests):
+        responses = []
+        for request in requests:
+            content = request.image.content
+            responses.append(
+                vision.AnnotateImageResponse(
+                    text_annotations=text_annotations(
+                        f"image {image_red(content)}",
+                        Image.open(io.BytesIO(content)).size,
+                    )
+                )
+            )
+        return vision.BatchAnnotateImagesResponse(responses=responses)
+
+    client = mock.Mock()
+    client.batch_annotate_images.side_effect = batch_annotate_images
+    monkeypatch.setattr(ocr_module, "_vision_client", client)
+    ocr = Ocr(pixels_per_image=100, google_image_format=GoogleImageFormat.png)
+    labels_and_bounding_polys = ocr.batch(images_bytes)
+    assert [
+        len(call.kwargs["requests"])
+        for call in client.batch_annotate_images.call_args_list
+    ] == [MAX_IMAGES_PER_VISION_REQUEST, 1]
+    for image_idx, (label, bounding_polys) in enumerate(labels_and_bounding_polys):
+        assert label == f"image {image_idx}"
+        # the word covering the preprocessed image covers the image it comes from
+        corner = bounding_polys[0].lower_right_reading_corner
+        assert (corner.x, corner.y) == pytest.approx((40 + image_idx, 30))
+
+    client.batch_annotate_images.side_effect = (
+        lambda requests: vision.BatchAnnotateImagesResponse(
+            responses=[vision.AnnotateImageResponse() for _ in requests]
+        )
+    )
+    with pytest.raises(TextNotFound):
+        ocr.batch(images_bytes[:2])
+
+
+def test_images_sent_one_by_one_keep_their_order(monkeypatch):
+    n_images = 8
+    images_bytes = [
+        encoded_image((40, 30), (image_idx, 0, 0)) for image_idx in range(n_images)
+    ]
+
+    def text_detection(image):
+        image_idx = image_red(image.content)
+        # the first images are the last ones read
+        time.sleep(0.01 * (n_images - image_idx))
+        if image_idx == failing_image_idx:
+            raise RuntimeError("Google Vision is unavailable")
+        return vision.AnnotateImageResponse(
+            text_annotations=text_annotations(f"image {image_idx}", (40, 30))
+        )
+
+    client = mock.Mock()
+    client.text_detection.side_effect = text_detection
+    monkeypatch.setattr(ocr_module, "_vision_client", client)
+    ocr = Ocr(
+        pixels_per_image=100,
+        google_image_format=GoogleImageFormat.png,
+        batch_vision_requests=False,
+        max_concurrent_images=4,
+    )
+    failing_image_idx = None
+    assert [label for label, _ in ocr.batch(images_bytes)] == [
+        f"image {image_idx}" for image_idx in range(n_images)
+    ]
+    assert client.text_detection.call_count == n_images
+
+    failing_image_idx = 5
+    with pytest.raises(RuntimeError, match="Google Vision is unavailable"):
+        ocr.batch(images_bytes)
+
+
+@pytest.mark.parametrize("image_format", ["JPEG", "PNG"])
+@pytest.mark.parametrize(
+    "vertices",
+    [
+        None,
+        # straight text
+        [(100, 200), (1300, 200), (1300, 500), (100, 500)],
+        # text rotated to the right and to the left
+        [(900, 100), (900, 1100), (600, 1100), (600, 100)],
+        [(600, 1100), (600, 100), (900, 100), (900, 1100)],
+    ],
+)
+def test_read_and_preprocess_gives_the_sizes_of_preprocess(image_format, vertices):
+    image_bytes = encoded_image((1600, 1200), (200, 100, 50), image_format)
+    image_bounding_polys = None
+    if vertices is not None:
+        image_bounding_polys = [
+            OcrBoundingPoly(vertices=[dict(x=x, y=y) for x, y in vertices])
+        ]
+    ocr = Ocr()
+    preprocessed_image = ocr._read_and_preprocess(image_bytes, image_bounding_polys)
+    image = ocr.preprocess(
+        ocr.get_image_from_bytes(image_bytes),
+        image_bounding_polys=image_bounding_polys,
+    )
+    assert preprocessed_image.size == image.size
+    assert preprocessed_image.original_size == (1600, 1200)
+    sent_image = Image.open(io.BytesIO(preprocessed_image.content))
+    assert sent_image.size == image.size
+    assert sent_image.format == ocr.google_image_format
@@ -0,0 +1,264 @@
+import difflib
+import multiprocessing
+from unittest import mock
+
+import numpy as np
+import pytest
+
+from src.config import Config
+from src.words_matcher.match import MatchBatch, MatchFilter
+from src.words_matcher.pool import worker_pool
+from src.words_matcher.referential import CandidateIndexType
+from src.words_matcher.similarity import (
+    SimilarityType,
+    encode_words,
+    indel_similarities_np,
+)
+from src.words_matcher.words_matcher import WordsMatcher
+from tests.conftest import COUNTRIES, LABELS, MATERIALS_NAMES
+
+REFERENTIAL = sorted(
+    {
+        name
+        for names in MATERIALS_NAMES + [[country] for country in COUNTRIES]
+        for name in names
+        if name is not None
+    }
+)
+
+
+def found_words_per_label(words_matcher: WordsMatcher, **kwargs):
+    return [
+        {(match.found_word, match.matching_sub_sentence) for match in matches}
+        for matches in words_matcher.find_words_in_sentences(
+            sentences=LABELS, referential=REFERENTIAL, **kwargs
+        )
+    ]
+
+
+@pytest.mark.parametrize(
+    "ref_word, word",
+    [
+        ("polyester", "polgester"),
+        ("polyester", "pollestere"),
+        ("elasthanne", "olastan"),
+        ("sri lanka", "made in sri lanka"),
+        ("", ""),
+        ("coton", ""),
+        ("a" * 70, "a" * 35 + "b" * 40),
+    ],
+)
+def test_indel_np_similarity_bounds_difflib_ratio(ref_word: str, word: str):
+    similarity = indel_similarities_np(ref_word, *encode_words([word]))[0]
+    assert similarity >= difflib.SequenceMatcher(None, ref_word, word).ratio()
+    assert similarity == WordsMatcher.similarity(
+        ref_word, word, SimilarityType.indel_np
+    )
+
+
+@pytest.mark.parametrize(
+    "filter_kwargs",
+    [
+        dict(keep_best_same_match=False, filter_same_location_match=False),
+        dict(keep_best_same_match=True, filter_same_location_match=True),
+    ],
+)
+def test_indel_np_matches_difflib_on_labels(filter_kwargs: dict):
+    difflib_matches = found_words_per_label(
+        WordsMatcher(
+            similarity_type=SimilarityType.difflib,
+            similarity_threshold=Config.WordsMatcher.similarity_threshold,
+        ),
+        **filter_kwargs,
+    )
+    indel_np_matches = found_words_per_label(
+        WordsMatcher(
+            similarity_type=SimilarityType.indel_np,
+            similarity_threshold=Config.WordsMatcher.similarity_threshold,
+        ),
+        **filter_kwargs,
+    )
+    assert indel_np_matches == difflib_matches
+
+
+@pytest.mark.parametrize(
+    "candidate_index, multi_tokens_trie",
+    [
+        (CandidateIndexType.trigram, False),
+        (CandidateIndexType.bk_tree, False),
+        (None, True),
+        (CandidateIndexType.trigram, True),
+    ],
+)
+def test_candidate_selection_does_not_change_matches(
+    candidate_index: str, multi_tokens_trie: bool
+):
+    filter_kwargs = dict(keep_best_same_match=False, filter_same_location_match=False)
+    assert found_words_per_label(
+        WordsMatcher(
+            similarity_threshold=Config.WordsMatcher.similarity_threshold,
+            candidate_index=candidate_index,
+            multi_tokens_trie=multi_tokens_trie,
+        ),
+        **filter_kwargs,
+    ) == found_words_per_label(
+        WordsMatcher(
+            similarity_threshold=Config.WordsMatcher.similarity_threshold,
+            candidate_index=None,
+        ),
+        **filter_kwargs,
+    )
+
+
+def test_exact_match_fast_path_finds_exact_words():
+    words_matcher = WordsMatcher(
+        similarity_threshold=Config.WordsMatcher.similarity_threshold,
+        exact_match_fast_path=True,
+    )
+    matches = words_matcher.find_words_in_sentences(
+        sentences=["100 % Polyester made in Sri Lanka"],
+        referential=["polyester", "sri lanka", "sri", "lanka"],
+        keep_best_same_match=False,
+        filter_same_location_match=False,
+    )[0]
+    assert {(match.found_word, match.score) for match in matches} == {
+        ("polyester", 1.0),
+        ("sri lanka", 1.0),
+        ("sri", 1.0),
+        ("lanka", 1.0),
+    }
+
+
+def test_multi_process_extraction_matches_serial_extraction(monkeypatch):
+    # the pool falls back to serial extraction on a single cpu
+    monkeypatch.setattr(worker_pool, "processes", 2)
+    words_matcher = WordsMatcher(
+        similarity_threshold=Config.WordsMatcher.similarity_threshold
+    )
+    multi_process_words_matcher = WordsMatcher(
+        similarity_threshold=Config.WordsMatcher.similarity_threshold,
+        extract_with_multi_process=True,
+    )
+    referential = words_matcher.compile_referential(REFERENTIAL)
+    sentences = LABELS * 10
+    expected = words_matcher.find_words_in_sentences(sentences, referential)
+    for _ in range(2):
+        assert (
+            multi_process_words_matcher.find_words_in_sentences(sentences, referential)
+            == expected
+        )
+    worker_pool.close()
+
+
+def test_multi_process_extraction_does_not_restart_the_pool_for_the_same_words(
+    monkeypatch,
+):
+    monkeypatch.setattr(worker_pool, "processes", 2)
+    pool_class = mock.Mock(wraps=multiprocessing.Pool)
+    monkeypatch.setattr(multiprocessing, "Pool", pool_class)
+    worker_pool.close()
+    words_matcher = WordsMatcher(
+        similarity_threshold=Config.WordsMatcher.similarity_threshold,
+        extract_with_multi_process=True,
+    )
+    for _ in range(3):
+        # a new list of the same words each time
+        words_matcher.find_words_in_sentences(LABELS * 10, list(REFERENTIAL))
+    pool_class.assert_called_once()
+    worker_pool.close()
+
+
+@pytest.mark.parametrize(
+    "filter_on, expected_matches",
+    [
+        (MatchFilter.longest, [("coton bio", 0), ("polyester", 16)]),
+        # ties go to the first match given
+        (MatchFilter.best, [("coton", 10), ("polyester", 16)]),
+    ],
+)
+def test_filter_same_location_matches(filter_on: str, expected_matches: list):
+    sentence = "coton bio coton polyester"
+    # found word, matching sub sentence, score, start and end of each match
+    matches = [
+        ("coton", "coton", 1.0, 10, 14),
+        ("coton bio", "coton bio", 0.9, 0, 8),
+        ("coton", "coton", 1.0, 0, 4),
+        ("polyester", "polyester", 1.0, 16, 24),
+        ("bio", "bio coton", 0.9, 6, 14),
+    ]
+    referential_words = ["coton", "coton bio", "polyester", "bio"]
+    sub_sentences = ["coton", "coton bio", "polyester", "bio coton"]
+    match_batch = MatchBatch(
+        sentence=sentence,
+        referential=WordsMatcher().compile_referential(referential_words),
+        sub_sentences=sub_sentences,
+        entries_idxs=np.array([referential_words.index(match[0]) for match in matches]),
+        sub_sentences_idxs=np.array(
+            [sub_sentences.index(match[1]) for match in matches]
+        ),
+        starts=np.array([match[3] for match in matches]),
+        ends=np.array([match[4] for match in matches]),
+        scores=np.array([match[2] for match in matches]),
+    )
+    assert [
+        (match.found_word, match.start)
+        for match in match_batch.without_overlaps(filter_on=filter_on).to_matches()
+    ] == expected_matches
+
+
+def test_match_batches_give_the_same_matches():
+    words_matcher = WordsMatcher(
+        similarity_threshold=Config.WordsMatcher.similarity_threshold
+    )
+    match_batches = words_matcher.find_match_batches(LABELS, REFERENTIAL)
+    assert [
+        match_batch.to_matches() for match_batch in match_batches
+    ] == words_matcher.find_words_in_sentences(LABELS, REFERENTIAL)
+    assert sum(map(len, match_batches)) > 0
+
+
+def test_repeated_sub_sentences_are_all_matched():
+    words_matcher = WordsMatcher(
+        similarity_threshold=Config.WordsMatcher.similarity_threshold
+    )
+    matches = words_matcher.find_words_in_sentences(
+        sentences=["polyestr coton polyestr"],
+        referential=["polyester"],
+        keep_best_same_match=False,
+        filter_same_location_match=False,
+    )[0]
+    assert [(match.start, match.end) for match in matches] == [(0, 7), (15, 22)]
+    assert matches[0].score == matches[1].score
+
+
+def test_similarity_cache_does_not_change_matches():
+    words_matcher = WordsMatcher(
+        similarity_threshold=Config.WordsMatcher.similarity_threshold,
+        similarity_cache_size=100000,
+    )
+    expected = found_words_per_label(
+        WordsMatcher(similarity_threshold=Config.WordsMatcher.similarity_threshold)
+    )
+    assert found_words_per_label(words_matcher) == expected
+    info = words_matcher.similarity_cache.info()
+    assert info.misses > 0 and info.currsize > 0
+    assert found_words_per_label(words_matcher) == expected
+    assert words_matcher.similarity_cache.info().hits >= info.misses
+
+
+@pytest.mark.parametrize(
+    "sentence, expected_words",
+    [
+        ("100 % хлопок", ["хлопок"]),
+        # found in latin, the spelling written in greek is not compared to the label
+        ("50 % cotton 50 % wolle", ["wolle"]),
+        # nothing found in latin, the spellings in other scripts are compared as well
+        ("100 % cotton", ["κotton"]),
+    ],
+)
+def test_script_pruning(sentence: str, expected_words: list):
+    words_matcher = WordsMatcher(script_pruning=True)
+    matches = words_matcher.find_words_in_sentences(
+        sentences=[sentence], referential=["wolle", "хлопок", "κotton"]
+    )[0]
+    assert [match.found_word for match in matches] == expected_words